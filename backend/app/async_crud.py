@@ -0,0 +1,57 @@
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from . import models, schemas, leaderboard
+
+# Асинхронные версии запросов для авторизации и регистрации (get_current_user,
+# вход, регистрация) - они выполняются на каждый запрос и не должны блокировать event loop.
+# Предметы, задачи, команды и чат обслуживают синхронные эндпоинты (def): FastAPI
+# выполняет их в пуле потоков, и event loop они не блокируют.
+# Связи, которые отдаются в ответах API, подгружаются заранее:
+# ленивая загрузка в AsyncSession недоступна.
+
+# --- User CRUD ---
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.class_info)).filter(models.User.user_id == user_id)
+    )
+    return result.scalars().first()
+
+async def get_user_by_nickname(db: AsyncSession, nickname: str):
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.class_info)).filter(models.User.nickname == nickname)
+    )
+    return result.scalars().first()
+
+async def get_user_by_login(db: AsyncSession, login: str):
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.class_info)).filter(models.User.login == login)
+    )
+    return result.scalars().first()
+
+async def get_user_team_id(db: AsyncSession, user_id: int):
+    """Текущая команда пользователя из БД (см. crud.get_user_team_id)"""
+    result = await db.execute(select(models.User.team_id).filter(models.User.user_id == user_id))
+    return result.scalar()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    """Создать пользователя (пароль хешируется заранее, вне event loop)"""
+    db_user = models.User(
+        login=user.login, 
+        nickname=user.nickname, 
+        hashed_password=hashed_password,
+        information=user.information,
+        class_id=user.class_id
+    )
+    db.add(db_user)
+    await db.commit()
+    db_user = await get_user(db, db_user.user_id)
+    leaderboard.update_user(db_user)
+    return db_user
+
+async def update_user_password_hash(db: AsyncSession, user_id: int, hashed_password: str):
+    """Перезаписать хеш пароля (rehash при входе)"""
+    await db.execute(
+        update(models.User).where(models.User.user_id == user_id).values(hashed_password=hashed_password)
+    )
+    await db.commit()
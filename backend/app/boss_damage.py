@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+from typing import Dict
+
+from .database import SessionLocal
+
+# Накопитель урона по боссам: удары складываются в памяти процесса и
+# записываются в teams.boss_lives пачками раз в BOSS_DAMAGE_FLUSH_INTERVAL_MS,
+# а не отдельным UPDATE на каждый удар. Удар, который по оценке добивает
+# босса, записывается сразу (crud.record_boss_hit), поэтому победа точная.
+BOSS_DAMAGE_FLUSH_INTERVAL_MS = int(os.getenv("BOSS_DAMAGE_FLUSH_INTERVAL_MS", "500"))
+
+
+class BossDamageAccumulator:
+    """Несписанный урон по (team_id, boss_id); потокобезопасен"""
+
+    def __init__(self):
+        self._pending: Dict[int, Dict[int, int]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "flushes": 0, "dropped_damage": 0}
+
+    def add(self, team_id: int, boss_id: int, damage: int, hits: int = 1) -> int:
+        """Добавить урон; возвращает весь несписанный урон этого процесса по боссу"""
+        with self._lock:
+            bosses = self._pending.setdefault(team_id, {})
+            bosses[boss_id] = bosses.get(boss_id, 0) + damage
+            self.stats["hits"] += hits
+            return bosses[boss_id]
+
+    def count(self, key: str, value: int = 1):
+        """Увеличить счетчик статистики (списания и отброшенный урон считает crud)"""
+        with self._lock:
+            self.stats[key] += value
+
+    def pending(self, team_id: int, boss_id: int) -> int:
+        with self._lock:
+            return self._pending.get(team_id, {}).get(boss_id, 0)
+
+    def take(self, team_id: int) -> Dict[int, int]:
+        """Забрать урон команды для записи (другие потоки его уже не увидят)"""
+        with self._lock:
+            return self._pending.pop(team_id, {})
+
+    def take_all(self) -> Dict[int, Dict[int, int]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "pending_teams": len(self._pending),
+                "pending_damage": sum(sum(bosses.values()) for bosses in self._pending.values()),
+            }
+
+
+accumulator = BossDamageAccumulator()
+
+
+class BossDamageFlusher:
+    """Фоновая периодическая запись накопленного урона; flush(db) - функция записи"""
+
+    def __init__(self, flush, session_factory=SessionLocal):
+        self.flush = flush
+        self.session_factory = session_factory
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def flush_once(self):
+        with self.session_factory() as db:
+            self.flush(db)
+
+    async def _run(self):
+        interval = BOSS_DAMAGE_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush_once)
+            except Exception as e:
+                print(f"Error flushing boss damage: {e}")
+
+    async def stop(self):
+        """Остановить фоновую запись и списать то, что осталось"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self.flush_once)
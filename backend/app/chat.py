@@ -0,0 +1,123 @@
+import asyncio
+import os
+from typing import Dict, List
+
+from fastapi import WebSocket, status
+
+from .chat_broker import ChatBroker
+
+# Настройки рассылки сообщений командного чата
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# "disconnect" - отключать клиента с переполненной очередью, "drop" - только терять новые сообщения
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+
+
+class TeamConnection:
+    """Соединение участника с собственной очередью исходящих сообщений и задачей-отправителем"""
+
+    def __init__(self, websocket: WebSocket, team_id: int, manager: "TeamConnectionManager"):
+        self.websocket = websocket
+        self.team_id = team_id
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.closed = False
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: str) -> bool:
+        """Поставить сообщение в очередь без ожидания; False, если клиент не успевает"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.manager.stats["dropped_messages"] += 1
+            if WS_SLOW_CONSUMER_POLICY == "disconnect":
+                self.manager.stats["slow_consumers_disconnected"] += 1
+                self.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Отправка не удалась или зависла - соединение больше не используем
+            self.manager.stats["send_errors"] += 1
+            self.close()
+
+    def close(self, code: int = status.WS_1011_INTERNAL_ERROR):
+        """Убрать соединение из рассылки и закрыть сокет"""
+        if self.closed:
+            return
+        self.closed = True
+        self.manager.remove(self)
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        asyncio.ensure_future(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class TeamConnectionManager:
+    def __init__(self, broker: ChatBroker, scope: str = "team"):
+        self.active_connections: Dict[int, List[TeamConnection]] = {}
+        self.stats = {"dropped_messages": 0, "slow_consumers_disconnected": 0, "send_errors": 0}
+        self.broker = broker
+        self.scope = scope
+        broker.register(scope, self.deliver)
+
+    async def connect(self, websocket: WebSocket, team_id: int) -> TeamConnection:
+        await websocket.accept()
+        connection = TeamConnection(websocket, team_id, self)
+        if team_id not in self.active_connections:
+            self.active_connections[team_id] = []
+        self.active_connections[team_id].append(connection)
+        return connection
+
+    def remove(self, connection: TeamConnection):
+        connections = self.active_connections.get(connection.team_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.team_id]
+
+    def disconnect(self, websocket: WebSocket, team_id: int):
+        for connection in list(self.active_connections.get(team_id, [])):
+            if connection.websocket is websocket:
+                connection.closed = True
+                connection.writer.cancel()
+                self.remove(connection)
+
+    async def send_to_team(self, message: str, team_id: int):
+        # Через брокер сообщение дойдет и до участников, подключенных к другим воркерам
+        await self.broker.publish(self.scope, team_id, message)
+
+    async def deliver(self, team_id, message: str):
+        # Только раскладываем по очередям: медленный клиент не задерживает остальных
+        for connection in list(self.active_connections.get(team_id, [])):
+            connection.enqueue(message)
+
+    def get_stats(self) -> dict:
+        """Метрики очередей отправки"""
+        depths = [
+            connection.queue.qsize()
+            for connections in self.active_connections.values()
+            for connection in connections
+        ]
+        return {
+            **self.stats,
+            "teams": len(self.active_connections),
+            "connections": len(depths),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size_limit": WS_SEND_QUEUE_SIZE,
+        }
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+# Архив чата: сообщения старше CHAT_ARCHIVE_AFTER_DAYS переносятся из chat_messages
+# в сжатые блоки chat_archive_blocks (по CHAT_ARCHIVE_BLOCK_SIZE сообщений).
+# Горячая таблица и ее индекс остаются небольшими, а история по-прежнему доступна
+# через обычную пагинацию чата. 0 - архивация выключена.
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+CHAT_ARCHIVE_BLOCK_SIZE = int(os.getenv("CHAT_ARCHIVE_BLOCK_SIZE", "500"))
+CHAT_ARCHIVE_INTERVAL_SECONDS = int(os.getenv("CHAT_ARCHIVE_INTERVAL_SECONDS", "3600"))
+CHAT_ARCHIVE_COMPRESSION_LEVEL = 6
+
+
+def encode_block(messages) -> bytes:
+    """Сжать сообщения блока: [message_id, user_id, message, timestamp] в порядке (timestamp, message_id)"""
+    rows = [[m.message_id, m.user_id, m.message, m.timestamp.isoformat()] for m in messages]
+    raw = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, CHAT_ARCHIVE_COMPRESSION_LEVEL)
+
+
+def decode_block(block: models.ChatArchiveBlock) -> list:
+    """Распаковать блок в список сообщений (словари в формате схемы ChatMessage, без user)"""
+    rows = json.loads(zlib.decompress(block.data))
+    return [
+        {
+            "message_id": message_id,
+            "team_id": block.team_id,
+            "user_id": user_id,
+            "message": message,
+            "timestamp": datetime.fromisoformat(timestamp),
+        }
+        for message_id, user_id, message, timestamp in rows
+    ]
+
+
+def _position(message: dict):
+    return message["timestamp"], message["message_id"]
+
+
+def archive_team_block(db: Session, team_id: int, cutoff: datetime) -> int:
+    """Перенести в архив один блок самых старых сообщений команды; возвращает число сообщений"""
+    ChatMessage = models.ChatMessage
+    # SKIP LOCKED: воркеры, запустившие архивацию одновременно, не заархивируют одно и то же дважды
+    messages = db.query(ChatMessage).filter(
+        ChatMessage.team_id == team_id, ChatMessage.timestamp < cutoff
+    ).order_by(
+        ChatMessage.timestamp.asc(), ChatMessage.message_id.asc()
+    ).limit(CHAT_ARCHIVE_BLOCK_SIZE).with_for_update(skip_locked=True).all()
+    if not messages:
+        db.rollback()
+        return 0
+
+    db.add(models.ChatArchiveBlock(
+        team_id=team_id,
+        first_message_id=messages[0].message_id,
+        last_message_id=messages[-1].message_id,
+        first_timestamp=messages[0].timestamp,
+        last_timestamp=messages[-1].timestamp,
+        message_count=len(messages),
+        min_message_id=min(m.message_id for m in messages),
+        max_message_id=max(m.message_id for m in messages),
+        data=encode_block(messages),
+    ))
+    db.query(ChatMessage).filter(
+        ChatMessage.message_id.in_([m.message_id for m in messages])
+    ).delete(synchronize_session=False)
+    db.commit()
+    db.expunge_all()
+    return len(messages)
+
+
+def archive_old_messages(db: Session, cutoff: datetime) -> dict:
+    """Заархивировать все сообщения старше cutoff, блок за блоком (каждый - своя транзакция)"""
+    ChatMessage = models.ChatMessage
+    team_ids = [row[0] for row in db.query(ChatMessage.team_id).filter(
+        ChatMessage.timestamp < cutoff
+    ).distinct().all()]
+    db.rollback()
+
+    result = {"blocks": 0, "messages": 0}
+    for team_id in team_ids:
+        while True:
+            archived = archive_team_block(db, team_id, cutoff)
+            if not archived:
+                break
+            result["blocks"] += 1
+            result["messages"] += archived
+            if archived < CHAT_ARCHIVE_BLOCK_SIZE:
+                break
+    return result
+
+
+def find_archived_position(db: Session, team_id: int, message_id: int):
+    """Позиция (timestamp, message_id) заархивированного сообщения или None"""
+    ChatArchiveBlock = models.ChatArchiveBlock
+    blocks = db.query(ChatArchiveBlock).filter(
+        ChatArchiveBlock.team_id == team_id,
+        ChatArchiveBlock.min_message_id <= message_id,
+        ChatArchiveBlock.max_message_id >= message_id,
+    ).all()
+    for block in blocks:
+        for message in decode_block(block):
+            if message["message_id"] == message_id:
+                return _position(message)
+    return None
+
+
+def get_archived_messages(db: Session, team_id: int, limit: int, before=None, after=None) -> list:
+    """Страница из архива в хронологическом порядке.
+
+    before/after - позиции (timestamp, message_id); без них - последние limit сообщений архива.
+    Блоки читаются по одному, пока страница не наберется.
+    """
+    if limit <= 0:
+        return []
+    ChatArchiveBlock = models.ChatArchiveBlock
+    query = db.query(ChatArchiveBlock).filter(ChatArchiveBlock.team_id == team_id)
+    first = tuple_(ChatArchiveBlock.first_timestamp, ChatArchiveBlock.first_message_id)
+    last = tuple_(ChatArchiveBlock.last_timestamp, ChatArchiveBlock.last_message_id)
+
+    page = []
+    if after is not None:
+        query = query.filter(last > tuple_(*after)).order_by(
+            ChatArchiveBlock.last_timestamp.asc(), ChatArchiveBlock.last_message_id.asc()
+        )
+        for block in query.yield_per(4):
+            page.extend(m for m in decode_block(block) if _position(m) > after)
+            if len(page) >= limit:
+                break
+        page.sort(key=_position)
+        page = page[:limit]
+    else:
+        if before is not None:
+            query = query.filter(first < tuple_(*before))
+        query = query.order_by(ChatArchiveBlock.last_timestamp.desc(), ChatArchiveBlock.last_message_id.desc())
+        for block in query.yield_per(4):
+            page.extend(m for m in decode_block(block) if before is None or _position(m) < before)
+            if len(page) >= limit:
+                break
+        page.sort(key=_position)
+        page = page[-limit:]
+
+    # Авторы сообщений - одним запросом на всю страницу
+    user_ids = {m["user_id"] for m in page}
+    users = {}
+    if user_ids:
+        users = {u.user_id: u for u in db.query(models.User).filter(models.User.user_id.in_(user_ids)).all()}
+    for message in page:
+        message["user"] = users.get(message["user_id"])
+    return page
+
+
+def delete_team_archive(db: Session, team_id: int):
+    """Удалить архив команды одним запросом (без commit)"""
+    db.query(models.ChatArchiveBlock).filter(
+        models.ChatArchiveBlock.team_id == team_id
+    ).delete(synchronize_session=False)
+
+
+class ChatArchiver:
+    """Фоновая периодическая архивация старых сообщений"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._task = None
+        self.stats = {"runs": 0, "blocks": 0, "messages": 0, "errors": 0, "last_run": None}
+
+    async def start(self):
+        if CHAT_ARCHIVE_AFTER_DAYS <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    def run_once(self) -> dict:
+        cutoff = datetime.utcnow() - timedelta(days=CHAT_ARCHIVE_AFTER_DAYS)
+        with self.session_factory() as db:
+            result = archive_old_messages(db, cutoff)
+        self.stats["runs"] += 1
+        self.stats["blocks"] += result["blocks"]
+        self.stats["messages"] += result["messages"]
+        self.stats["last_run"] = datetime.utcnow().isoformat()
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                # Синхронная сессия - в отдельном потоке, чтобы не блокировать event loop
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error archiving chat messages: {e}")
+            await asyncio.sleep(CHAT_ARCHIVE_INTERVAL_SECONDS)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "archive_after_days": CHAT_ARCHIVE_AFTER_DAYS}
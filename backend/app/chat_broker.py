@@ -0,0 +1,140 @@
+import asyncio
+from abc import ABC, abstractmethod
+import json
+import os
+import uuid
+from typing import Awaitable, Callable, Dict
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+# Брокер сообщений чата между воркерами:
+#   memory   - только текущий процесс (один воркер uvicorn)
+#   postgres - LISTEN/NOTIFY в той же базе, работает между воркерами и хостами
+CHAT_BROKER = os.getenv("CHAT_BROKER", "memory")
+CHAT_NOTIFY_CHANNEL = os.getenv("CHAT_NOTIFY_CHANNEL", "team_chat")
+# Ограничение PostgreSQL на размер payload в NOTIFY - 8000 байт
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+Handler = Callable[[object, str], Awaitable[None]]
+
+
+class ChatBroker(ABC):
+    """Публикация сообщений чата всем воркерам; доставка - через зарегистрированные обработчики"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+
+    def register(self, scope: str, handler: Handler):
+        """Подписать обработчик на сообщения области (team - командный чат, room - старый чат)"""
+        self.handlers[scope] = handler
+
+    async def dispatch(self, scope: str, key, message: str):
+        handler = self.handlers.get(scope)
+        if handler is not None:
+            await handler(key, message)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, scope: str, key, message: str):
+        """Разослать сообщение всем воркерам (включая текущий)"""
+
+
+class InMemoryBroker(ChatBroker):
+    """Доставка внутри одного процесса"""
+
+    async def publish(self, scope: str, key, message: str):
+        await self.dispatch(scope, key, message)
+
+
+class PostgresBroker(ChatBroker):
+    """Доставка через LISTEN/NOTIFY: свои сообщения рассылаются сразу, чужие приходят из канала"""
+
+    def __init__(self, dsn: str, channel: str = CHAT_NOTIFY_CHANNEL):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._listen_connection = None
+        self._publish_connection = None
+        self._publish_lock = asyncio.Lock()
+        self._reconnect_task = None
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        await self._listen()
+
+    async def _listen(self):
+        self._listen_connection = await asyncpg.connect(self.dsn)
+        self._listen_connection.add_termination_listener(self._on_connection_lost)
+        await self._listen_connection.add_listener(self.channel, self._on_notify)
+
+    def _on_connection_lost(self, connection):
+        if not self._stopping and self._reconnect_task is None:
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 0.5
+        try:
+            while not self._stopping:
+                try:
+                    await self._listen()
+                    return
+                except Exception as e:
+                    print(f"Chat broker: LISTEN reconnect failed: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30)
+        finally:
+            self._reconnect_task = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if data.get("origin") == self.origin:
+            return
+        asyncio.ensure_future(self.dispatch(data["scope"], data["key"], data["message"]))
+
+    async def publish(self, scope: str, key, message: str):
+        await self.dispatch(scope, key, message)
+        payload = json.dumps({"origin": self.origin, "scope": scope, "key": key, "message": message})
+        if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT:
+            print(f"Chat broker: message for {scope}:{key} is too large for NOTIFY, delivered locally only")
+            return
+        async with self._publish_lock:
+            try:
+                if self._publish_connection is None or self._publish_connection.is_closed():
+                    self._publish_connection = await asyncpg.connect(self.dsn)
+                await self._publish_connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            except Exception as e:
+                print(f"Chat broker: NOTIFY failed: {e}")
+                self._publish_connection = None
+
+    async def stop(self):
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for connection in (self._listen_connection, self._publish_connection):
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        self._listen_connection = None
+        self._publish_connection = None
+
+
+def get_asyncpg_dsn(database_url: str) -> str:
+    """DSN для asyncpg (без указания драйвера SQLAlchemy)"""
+    url = make_url(database_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+def create_broker(database_url: str) -> ChatBroker:
+    if CHAT_BROKER == "postgres":
+        return PostgresBroker(get_asyncpg_dsn(database_url))
+    return InMemoryBroker()
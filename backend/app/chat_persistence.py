@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+from .database import AsyncSessionLocal
+
+# Отложенная запись сообщений чата: сообщения из WebSocket копятся в очереди
+# и сохраняются одним INSERT на пачку
+CHAT_FLUSH_INTERVAL_MS = int(os.getenv("CHAT_FLUSH_INTERVAL_MS", "50"))
+CHAT_FLUSH_BATCH_SIZE = int(os.getenv("CHAT_FLUSH_BATCH_SIZE", "200"))
+CHAT_PERSIST_QUEUE_SIZE = int(os.getenv("CHAT_PERSIST_QUEUE_SIZE", "10000"))
+CHAT_FLUSH_RETRIES = 3
+# Пачка, которую не удалось записать, остается в памяти и повторяется раз в
+# CHAT_RETRY_INTERVAL_MS. Если таких сообщений больше CHAT_PERSIST_QUEUE_SIZE или
+# процесс останавливается, они сохраняются в CHAT_SPILL_DIR и при следующем старте
+# любого воркера снова ставятся на запись. Строки, которые БД отвергает (IntegrityError),
+# не повторяются: они откладываются в CHAT_SPILL_DIR/rejected, остальная пачка записывается.
+CHAT_RETRY_INTERVAL_MS = int(os.getenv("CHAT_RETRY_INTERVAL_MS", "5000"))
+CHAT_SPILL_DIR = os.getenv(
+    "CHAT_SPILL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chats", "unsaved")
+)
+
+_STOP = object()
+
+
+def _write_jsonl(path: str, items, mode: str = "w"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode, encoding="utf-8") as jsonl_file:
+        for item in items:
+            jsonl_file.write(json.dumps({**item, "timestamp": item["timestamp"].isoformat()}, ensure_ascii=False) + "\n")
+
+
+class ChatPersistencePipeline:
+    """Очередь сообщений чата с периодической пакетной записью в БД.
+
+    Один фоновый сборщик забирает сообщения в порядке поступления, поэтому
+    порядок внутри команды сохраняется (и по timestamp, и по message_id).
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.queue: asyncio.Queue = None
+        self._task = None
+        self.stats = {"persisted": 0, "batches": 0, "failed": 0, "spilled": 0, "recovered": 0, "rejected": 0}
+        # Сообщения, которые не удалось записать (старше всех сообщений в очереди)
+        self._retry = []
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=CHAT_PERSIST_QUEUE_SIZE)
+        self._retry = self._load_spilled()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, team_id: int, user_id: int, message: str):
+        """Поставить сообщение в очередь на запись (ждет только при переполнении очереди)"""
+        await self.queue.put({
+            "team_id": team_id,
+            "user_id": user_id,
+            "message": message,
+            "timestamp": datetime.utcnow(),
+        })
+
+    async def _run(self):
+        interval = CHAT_FLUSH_INTERVAL_MS / 1000
+        loop = asyncio.get_running_loop()
+        failing = False
+        stopping = False
+        while not stopping:
+            # Незаписанные ранее сообщения идут первыми, новые дописываются за ними
+            pending = self._retry
+            if not pending or failing:
+                # После сбоя записи не повторяем ее чаще, чем раз в CHAT_RETRY_INTERVAL_MS
+                timeout = CHAT_RETRY_INTERVAL_MS / 1000 if pending else None
+                try:
+                    first = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    first = None
+                if first is _STOP:
+                    stopping = True
+                elif first is not None:
+                    pending.append(first)
+            deadline = loop.time() + interval
+            while not stopping and len(pending) < CHAT_FLUSH_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                pending.append(item)
+            failing = not await self._flush_next()
+        # Остановка: дописываем отложенное, пока запись проходит; остаток stop() сохранит в файл
+        while self._retry and await self._flush_next():
+            pass
+
+    async def _flush_next(self) -> bool:
+        """Записать первые CHAT_FLUSH_BATCH_SIZE отложенных сообщений; False - запись не прошла"""
+        batch = self._retry[:CHAT_FLUSH_BATCH_SIZE]
+        del self._retry[:len(batch)]
+        if not batch:
+            return True
+        unsaved = await self._flush(batch)
+        if not unsaved:
+            return True
+        self._retry[:0] = unsaved
+        if len(self._retry) > CHAT_PERSIST_QUEUE_SIZE:
+            self._spill()
+        return False
+
+    async def _flush(self, batch) -> list:
+        """Записать пачку; возвращает сообщения, которые нужно повторить позже"""
+        for attempt in range(CHAT_FLUSH_RETRIES):
+            try:
+                async with self.session_factory() as db:
+                    await db.execute(insert(models.ChatMessage), batch)
+                    await db.commit()
+                self.stats["persisted"] += len(batch)
+                self.stats["batches"] += 1
+                return []
+            except IntegrityError as e:
+                # БД отвергла строку пачки (например, команду уже удалили) - повтор не поможет.
+                # Делим пачку пополам, пока не останется сама отвергнутая строка
+                if len(batch) == 1:
+                    self._reject(batch[0], e)
+                    return []
+                middle = len(batch) // 2
+                unsaved = await self._flush(batch[:middle])
+                if unsaved:
+                    # БД стала недоступна - вторую половину не пишем, чтобы сохранить порядок
+                    return unsaved + batch[middle:]
+                return await self._flush(batch[middle:])
+            except Exception as e:
+                print(f"Error flushing chat messages (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(0.1 * (attempt + 1))
+        # Сообщения уже разосланы клиентам - не теряем их, а повторим запись позже
+        self.stats["failed"] += len(batch)
+        return batch
+
+    def _reject(self, item, error):
+        """Отложить сообщение, которое БД не принимает, в CHAT_SPILL_DIR/rejected (повторно не пишется)"""
+        path = os.path.join(CHAT_SPILL_DIR, "rejected", f"{datetime.utcnow():%Y%m%d}.jsonl")
+        _write_jsonl(path, [item], mode="a")
+        print(f"Rejected chat message of team {item['team_id']}: {error.orig}")
+        self.stats["rejected"] += 1
+
+    def _spill(self):
+        """Сохранить незаписанные сообщения в файл для повторной записи после перезапуска"""
+        if not self._retry:
+            return
+        path = os.path.join(CHAT_SPILL_DIR, f"{uuid.uuid4().hex}.jsonl")
+        _write_jsonl(path + ".tmp", self._retry)
+        os.replace(path + ".tmp", path)
+        print(f"Saved {len(self._retry)} unsaved chat messages to {path}")
+        self.stats["spilled"] += len(self._retry)
+        self._retry = []
+
+    def _load_spilled(self) -> list:
+        """Забрать сообщения, сохраненные в файлы при прошлых сбоях записи"""
+        if not os.path.isdir(CHAT_SPILL_DIR):
+            return []
+        messages = []
+        for name in sorted(os.listdir(CHAT_SPILL_DIR)):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(CHAT_SPILL_DIR, name)
+            claimed = f"{path}.{os.getpid()}.claimed"
+            try:
+                # Переименование атомарно: файл заберет только один воркер
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as spill_file:
+                for line in spill_file:
+                    item = json.loads(line)
+                    item["timestamp"] = datetime.fromisoformat(item["timestamp"])
+                    messages.append(item)
+            os.remove(claimed)
+        messages.sort(key=lambda item: item["timestamp"])
+        self.stats["recovered"] += len(messages)
+        return messages
+
+    async def stop(self):
+        """Остановить сборщик, предварительно записав все, что уже в очереди"""
+        if self._task is None:
+            return
+        # Маркер встает в конец очереди: все сообщения до него будут записаны
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
+        self._spill()
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "queued": self.queue.qsize() if self.queue else 0, "pending_retry": len(self._retry)}
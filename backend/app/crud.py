@@ -1,9 +1,11 @@
+from sqlalchemy import case, func, tuple_, update
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload
-from . import models, schemas, security
+from sqlalchemy.orm import joinedload, selectinload
+from . import models, schemas, security, modifiers, user_cache, reference_cache, chat_archive, boss_damage, leaderboard, item_effects
 import json
 import random # For boss attack simulation
+from typing import List
 
 # --- User CRUD --- 
 def get_user(db: Session, user_id: int):
@@ -15,11 +17,17 @@ def get_user_by_nickname(db: Session, nickname: str):
 def get_user_by_login(db: Session, login: str):
     return db.query(models.User).filter(models.User.login == login).first()
 
+def get_user_team_id(db: Session, user_id: int):
+    """Текущая команда пользователя из БД (для проверок доступа: снимок из user_cache
+    другого воркера может хранить прежнюю команду до истечения TTL)"""
+    return db.query(models.User.team_id).filter(models.User.user_id == user_id).scalar()
+
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = security.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(user.password)
     db_user = models.User(
         login=user.login, 
         nickname=user.nickname, 
@@ -30,6 +38,7 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    leaderboard.update_user(db_user)
     return db_user
 
 def update_user_profile(db: Session, user_id: int, user_update: schemas.UserUpdate):
@@ -37,77 +46,91 @@ def update_user_profile(db: Session, user_id: int, user_update: schemas.UserUpda
     if not db_user:
         return None
     
-    update_data = user_update.dict(exclude_unset=True)
+    # Команда меняется только через add_member_to_team/leave_team: они правят счетчики команд
+    update_data = user_update.dict(exclude_unset=True, exclude={"team_id"})
+    previous_level = db_user.level
     for key, value in update_data.items():
         setattr(db_user, key, value)
+    adjust_team_stats(db, db_user.team_id, level_delta=db_user.level - previous_level)
     
     db.commit()
+    user_cache.invalidate_user(user_id)
     db.refresh(db_user)
+    leaderboard.update_user(db_user)
     return db_user
 
 def update_user_gold_xp(db: Session, user_id: int, gold_change: int = 0, points_change: int = 0):
     db_user = get_user(db, user_id)
-    db_useritems = get_user_items(db, user_id)
-    id_user_items = [id_items.item_id for id_items in db_useritems] 
     if db_user:
-        
-        first_exp = points_change
-        first_gold = gold_change
-        experience_reward = points_change
-        gold_reward = gold_change
-        
-        
-        # Классовые мультипликаторы
-        if db_user.class_id == 2:
-            experience_reward = int(experience_reward * 1.1)
-        elif db_user.class_id == 3:
-            gold_reward = int(gold_reward * 1.1)
-        
-        # Мультипликаторы вещей
-        if 5 in id_user_items:
-            experience_reward += int(first_exp * 0.05)
-        if 7 in id_user_items:
-            gold_reward += int(first_gold * 0.05)
-        if 9 in id_user_items:
-            if random.random() < 0.2:
-                experience_reward *= 2
-        if 12 in id_user_items:
-            if random.random() < 0.2:
-                gold_reward *= 2
-        if 14 in id_user_items:
-            experience_reward += int(first_exp * 0.1)
-        
+        user_modifiers = modifiers.get_user_modifiers(db, db_user)
+        gold_reward, experience_reward = user_modifiers.apply_rewards(gold_change, points_change)
         
         db_user.gold += gold_reward
         db_user.points += experience_reward
         
-        
-
-        
-        
-        # Level up if points exceed max_points
-        while db_user.points >= db_user.max_points:
-            db_user.points -= db_user.max_points
-            db_user.level += 1
-            db_user.max_points = 100 * db_user.level  # Формула опыта для уровней
-            db_user.attack += 1
+        adjust_team_stats(db, db_user.team_id, level_delta=apply_level_up(db_user))
             
         db.commit()
+        user_cache.invalidate_user(user_id)
         db.refresh(db_user)
+        leaderboard.update_user(db_user)
     return db_user
 
+def apply_level_up(db_user: models.User) -> int:
+    """Повысить уровень, пока опыт превышает порог (без коммита); возвращает число новых уровней"""
+    levels = 0
+    # Level up if points exceed max_points
+    while db_user.points >= db_user.max_points:
+        db_user.points -= db_user.max_points
+        db_user.level += 1
+        db_user.max_points = 100 * db_user.level  # Формула опыта для уровней
+        db_user.attack += 1
+        levels += 1
+    return levels
+
+def distribute_boss_rewards(db: Session, team_id: int, gold_reward: int):
+    """Начислить золото за босса всей команде несколькими запросами (без коммита)"""
+    members = db.query(
+        models.User.user_id, models.User.class_id, models.User.points, models.User.max_points
+    ).filter(models.User.team_id == team_id).all()
+    if not members:
+        return 0
+    
+    members_modifiers = modifiers.get_users_modifiers(db, members)
+    rewards = {}
+    for member in members:
+        member_modifiers = members_modifiers[member.user_id]
+        reward = 0
+        if member_modifiers.boss_gold_multiplier > 1:
+            reward += member_modifiers.apply_rewards(gold_reward * member_modifiers.boss_gold_multiplier, 0)[0]
+        reward += member_modifiers.apply_rewards(gold_reward, 0)[0]
+        rewards[member.user_id] = reward
+    
+    db.query(models.User).filter(
+        models.User.user_id.in_(list(rewards))
+    ).update(
+        {"gold": models.User.gold + case(rewards, value=models.User.user_id, else_=0)},
+        synchronize_session="fetch"
+    )
+    
+    # Золото не меняет опыт, но повышение уровня должно сработать как в update_user_gold_xp
+    level_up_ids = [member.user_id for member in members if member.points >= member.max_points]
+    if level_up_ids:
+        levels = 0
+        for db_user in db.query(models.User).filter(models.User.user_id.in_(level_up_ids)).all():
+            levels += apply_level_up(db_user)
+        adjust_team_stats(db, team_id, level_delta=levels)
+    
+    return len(members)
+
 def decrease_user_lives(db: Session, user_id: int, lives: int):
     user = get_user(db, user_id)
-    db_useritems = get_user_items(db, user_id)
-    id_user_items = [id_items.item_id for id_items in db_useritems]
+    user_modifiers = modifiers.get_user_modifiers(db, user)
     
-    if 10 in id_user_items:
-        if random.random() < 0.2:
-            return user
+    if user_modifiers.dodges():
+        return user
     
-    lives = user.lives
-    if 13 in id_user_items:
-        lives += 1
+    lives = lives + user_modifiers.lives_protection
     
     level = user.level
     max_points = user.max_points
@@ -121,6 +144,7 @@ def decrease_user_lives(db: Session, user_id: int, lives: int):
         attack = user.attack - 1 if user.attack > 1 else user.attack
         points = 0
         
+    adjust_team_stats(db, user.team_id, level_delta=level - user.level)
     user.lives = lives
     user.level = level
     user.max_points = max_points
@@ -128,7 +152,9 @@ def decrease_user_lives(db: Session, user_id: int, lives: int):
     user.points = points
     # Сохраняем изменения
     db.commit()
+    user_cache.invalidate_user(user_id)
     db.refresh(user)
+    leaderboard.update_user(user)
 
     return user
 
@@ -143,6 +169,9 @@ def create_class(db: Session, class_data: schemas.ClassCreate):
     db_class = models.Class(**class_data.dict())
     db.add(db_class)
     db.commit()
+    reference_cache.classes_cache.invalidate()
+    # Название класса входит в ответ /items
+    reference_cache.items_cache.invalidate()
     db.refresh(db_class)
     return db_class
 
@@ -151,6 +180,8 @@ def create_item(db: Session, item: schemas.ItemCreate):
     db_item = models.Item(**item.dict())
     db.add(db_item)
     db.commit()
+    reference_cache.items_cache.invalidate()
+    item_effects.effects.invalidate()
     db.refresh(db_item)
     return db_item
 
@@ -181,9 +212,86 @@ def add_item_to_user_inventory(db: Session, user_id: int, item_id: int):
     db_user_item = models.UserItem(user_id=user_id, item_id=item_id, active='false')
     db.add(db_user_item)
     db.commit()
+    modifiers.invalidate_user_modifiers(user_id)
     db.refresh(db_user_item)
     return db_user_item
 
+def _item_data(item: models.Item) -> dict:
+    return {
+        "item_id": item.item_id,
+        "name": item.name,
+        "price": item.price,
+        "information": item.information,
+        "type": item.type,
+        "class_id": item.class_id,
+        "bonus_type": item.bonus_type,
+        "bonus_data": item.bonus_data,
+    }
+
+def purchase_item(db: Session, user_id: int, item_id: int, idempotency_key: str = None):
+    """Купить предмет одной транзакцией; None, если предмета нет в магазине.
+
+    Золото списывается условным UPDATE (хватает золота, предмета еще нет в инвентаре,
+    подходит класс), предмет добавляется в той же транзакции. Если параллельный запрос
+    успел купить тот же предмет, вставка упирается в первичный ключ и откатывается
+    вместе со списанием. С idempotency_key повтор запроса возвращает результат первой
+    покупки. Возвращает {"status", "user_gold", "item"}; status - purchased, owned,
+    wrong_class, insufficient_gold или key_reused (ключ уже использован для другого предмета).
+    """
+    item = get_item(db, item_id)
+    if item is None:
+        return None
+    item_data = _item_data(item)
+    
+    if idempotency_key:
+        previous = db.query(models.ItemPurchase).filter(
+            models.ItemPurchase.user_id == user_id,
+            models.ItemPurchase.idempotency_key == idempotency_key
+        ).first()
+        if previous is not None:
+            status = "purchased" if previous.item_id == item_id else "key_reused"
+            return {"status": status, "user_gold": previous.user_gold, "item": item_data}
+    
+    User = models.User
+    owned = db.query(models.UserItem.item_id).filter(
+        models.UserItem.user_id == user_id, models.UserItem.item_id == item_id
+    ).exists()
+    conditions = [User.user_id == user_id, User.gold >= item.price, ~owned]
+    if item.class_id is not None:
+        conditions.append(User.class_id == item.class_id)
+    debited = db.execute(
+        update(User).where(*conditions).values(gold=User.gold - item.price).returning(User.gold),
+        execution_options={"synchronize_session": False},
+    ).first()
+    
+    if debited is None:
+        db.rollback()
+        # Покупка не прошла - выясняем причину (только на этом пути)
+        user = db.query(User.gold, User.class_id).filter(User.user_id == user_id).first()
+        if get_user_item(db, user_id, item_id) is not None:
+            status = "owned"
+        elif item_data["class_id"] is not None and user.class_id != item_data["class_id"]:
+            status = "wrong_class"
+        else:
+            status = "insufficient_gold"
+        return {"status": status, "user_gold": user.gold if user else 0, "item": item_data}
+    
+    db.add(models.UserItem(user_id=user_id, item_id=item_id, active='false'))
+    if idempotency_key:
+        db.add(models.ItemPurchase(
+            user_id=user_id, item_id=item_id, idempotency_key=idempotency_key,
+            price=item_data["price"], user_gold=debited.gold
+        ))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Параллельный запрос уже купил этот предмет (или с этим же ключом) - отвечаем по его итогу
+        db.rollback()
+        return purchase_item(db, user_id, item_id, idempotency_key)
+    modifiers.invalidate_user_modifiers(user_id)
+    user_cache.invalidate_user(user_id)
+    return {"status": "purchased", "user_gold": debited.gold, "item": item_data}
+
 def get_active_items_count(db: Session, user_id: int):
     """Получить количество активных предметов у пользователя"""
     return db.query(models.UserItem).filter(
@@ -193,108 +301,55 @@ def get_active_items_count(db: Session, user_id: int):
 
 
 def update_user_item_active_status(db: Session, user_id: int, item_id: int, active: str):
-    db_user_item = get_user_item(db, user_id, item_id)
-    db_user = get_user(db, user_id)
-    if not db_user_item:
+    """Активировать или снять предмет (расходуемый - применить) одной транзакцией.
+
+    Эффект берется из item_effects (по bonus_type/bonus_data предмета). Статус меняется
+    условным UPDATE: только если он действительно другой и, при активации, занято меньше
+    ACTIVE_ITEMS_LIMIT слотов, поэтому повторный запрос не применит бонус дважды.
+    Строка пользователя заблокирована до коммита, так что параллельные активации
+    не займут больше слотов. Для расходуемого предмета возвращает None.
+    """
+    UserItem = models.UserItem
+    effect = item_effects.get_effect(db, item_id)
+    db_user = _lock_user(db, user_id)
+    if effect is None or db_user is None:
+        # Предмета нет в магазине - ничего не меняем
+        db.rollback()
+        return get_user_item(db, user_id, item_id)
+    owned = (UserItem.user_id == user_id, UserItem.item_id == item_id)
+    
+    if active == 'true' and effect.consumable:
+        # DELETE "забирает" предмет: эффект применяется, только если он еще был в инвентаре
+        consumed = db.query(UserItem).filter(*owned).delete(synchronize_session=False)
+        levels = 0
+        if consumed:
+            levels = effect.consume(db_user)
+            adjust_team_stats(db, db_user.team_id, level_delta=levels)
+        db.commit()
+        if consumed:
+            modifiers.invalidate_user_modifiers(user_id)
+            user_cache.invalidate_user(user_id)
+            if levels:
+                leaderboard.update_users(db, [user_id])
         return None
-
-    # Если активируем предмет, проверяем количество уже активных предметов
-    if active == 'true':
-        if item_id in (1, 2, 3, 4):
-            if item_id == 1:
-                max_lives = db_user.max_lives
-                current_lives = db_user.lives
-                
-                current_lives = current_lives + round(max_lives * 0.25)
-                current_lives = current_lives if current_lives <= max_lives else max_lives
-                db_user.lives = current_lives
-                db.commit()
-                db.refresh(db_user)
-                remove_user_item(db, user_id, item_id)
-                return None
-            elif item_id == 2:
-                max_lives = db_user.max_lives
-                db_user.lives = max_lives
-                db.commit()
-                db.refresh(db_user)
-                remove_user_item(db, user_id, item_id)
-                return None
-            elif item_id == 3:
-                max_points = db_user.max_points
-                current_points = db_user.points
-                
-                current_points = current_points + round(max_points * 0.25)
-                if current_points >= max_points:
-                    current_points = 0
-                    db_user.level += 1
-                    db_user.max_points = 100 * db_user.level  # Формула опыта для уровней
-                    db_user.attack += 1
-                db_user.points = current_points
-                db.commit()
-                db.refresh(db_user)
-                remove_user_item(db, user_id, item_id)
-                return None
-            elif item_id == 4:
-                db_user.points = 0
-                db_user.level += 1
-                db_user.max_points = 100 * db_user.level  # Формула опыта для уровней
-                db_user.attack += 1
-                db.commit()
-                db.refresh(db_user)
-                remove_user_item(db, user_id, item_id)
-                return None
-        
-        # Получаем количество активных предметов
-        active_count = get_active_items_count(db, user_id)
-        
-        # Если уже 3 активных предмета, не позволяем активировать еще один
-        if active_count >= 3:
-            return None
-        
-        if item_id == 6:
-            db_user.lives += 3
-            db_user.max_lives += 3
-            db.commit()
-            db.refresh(db_user)
-        if item_id == 8:
-            db_user.attack += 5
-            db.commit()
-            db.refresh(db_user)
-        if item_id == 11:
-            db_user.attack += 10
-            db.commit()
-            db.refresh(db_user)
-        if item_id == 16:
-            db_user.attack += 20
-            db.commit()
-            db.refresh(db_user)    
-            
-            
-    if active == 'false':
-        if item_id == 6:
-            db_user.lives -= 3
-            db_user.max_lives -= 3
-            db.commit()
-            db.refresh(db_user)
-        if item_id == 8:
-            db_user.attack -= 5
-            db.commit()
-            db.refresh(db_user)
-        if item_id == 11:
-            db_user.attack -= 10
-            db.commit()
-            db.refresh(db_user)
-        if item_id == 16:
-            db_user.attack -= 20
-            db.commit()
-            db.refresh(db_user)
-            
-    # Устанавливаем статус активности
-    db_user_item.active = active
     
+    conditions = [*owned, UserItem.active != active]
+    if active == 'true':
+        # Свободный слот проверяется в том же UPDATE
+        active_count = db.query(func.count()).select_from(UserItem).filter(
+            UserItem.user_id == user_id, UserItem.active == 'true'
+        ).scalar_subquery()
+        conditions.append(active_count < item_effects.ACTIVE_ITEMS_LIMIT)
+    changed = db.query(UserItem).filter(*conditions).update({"active": active}, synchronize_session=False)
+    if changed:
+        effect.apply(db_user, 1 if active == 'true' else -1)
     db.commit()
-    db.refresh(db_user_item)
-    return db_user_item
+    if changed:
+        modifiers.invalidate_user_modifiers(user_id)
+        user_cache.invalidate_user(user_id)
+    
+    # Если все слоты заняты, предмет вернется с прежним статусом
+    return get_user_item(db, user_id, item_id)
 
 
 def remove_user_item(db: Session, user_id: int, item_id: int):
@@ -302,6 +357,7 @@ def remove_user_item(db: Session, user_id: int, item_id: int):
     if db_user_item:
         db.delete(db_user_item)
         db.commit()
+        modifiers.invalidate_user_modifiers(user_id)
     return db_user_item
 
 # --- Team CRUD ---
@@ -335,20 +391,27 @@ def get_team_members(db: Session, team_id: int):
         return []
 
 def create_team(db: Session, team: schemas.TeamCreate, owner_id: int):
+    """Создать команду и сразу добавить в нее владельца; None - владелец уже в команде"""
+    owner = _lock_user(db, owner_id)
+    if not owner or owner.team_id is not None:
+        db.rollback()
+        return None
+    
     db_team = models.Team(
         name=team.name,
         information=team.information,
         owner_id=owner_id
     )
     db.add(db_team)
-    db.commit()
-    db.refresh(db_team)
+    db.flush()
     
     # Добавляем владельца в команду
-    owner = get_user(db, owner_id)
-    if owner:
-        owner.team_id = db_team.team_id
-        db.commit()
+    owner.team_id = db_team.team_id
+    adjust_team_stats(db, db_team.team_id, level_delta=owner.level, members_delta=1)
+    db.commit()
+    user_cache.invalidate_user(owner_id)
+    db.refresh(db_team)
+    leaderboard.refresh_team(db, db_team.team_id)
     
     return db_team
 
@@ -363,48 +426,64 @@ def update_team(db: Session, team_id: int, team_update: schemas.TeamUpdate):
     
     db.commit()
     db.refresh(db_team)
+    leaderboard.update_team(db_team)
     return db_team
 
 def delete_team(db: Session, team_id: int):
     db_team = get_team(db, team_id)
     if db_team:
+        member_ids = [row[0] for row in db.query(models.User.user_id).filter(models.User.team_id == team_id)]
         # Удаляем всех участников из команды
         db.query(models.User).filter(models.User.team_id == team_id).update({"team_id": None})
         
-        # Удаляем сообщения чата
-        db.query(models.ChatMessage).filter(models.ChatMessage.team_id == team_id).delete()
+        # Удаляем сообщения чата и их архив
+        db.query(models.ChatMessage).filter(models.ChatMessage.team_id == team_id).delete(synchronize_session=False)
+        chat_archive.delete_team_archive(db, team_id)
         
         # Удаляем команду
         db.delete(db_team)
         db.commit()
+        user_cache.invalidate_team(team_id)
+        leaderboard.remove_team(team_id)
+        leaderboard.update_users(db, member_ids)
     return db_team
 
+def _lock_user(db: Session, user_id: int):
+    """Пользователь с блокировкой строки до коммита: уровень и команда не изменятся параллельно"""
+    return db.query(models.User).filter(
+        models.User.user_id == user_id
+    ).with_for_update().populate_existing().first()
+
 def add_member_to_team(db: Session, team_id: int, user_id: int):
     """Добавить участника в команду"""
-    user = get_user(db, user_id)
     team = get_team(db, team_id)
+    user = _lock_user(db, user_id)
     
     if not user or not team:
+        db.rollback()
         return None
         
     if user.team_id is not None:
+        db.rollback()
         return None  # Пользователь уже в команде
     
     user.team_id = team_id
+    adjust_team_stats(db, team_id, level_delta=user.level, members_delta=1)
     db.commit()
+    user_cache.invalidate_user(user_id)
     
     # Обновляем босса команды
     update_team_boss(db, team_id)
     
     db.refresh(user)
+    leaderboard.update_user(user)
     return user
 
 def remove_member_from_team(db: Session, team_id: int, user_id: int, remover_id: int):
     """Удалить участника из команды"""
     team = get_team(db, team_id)
-    user = get_user(db, user_id)
     
-    if not team or not user or user.team_id != team_id:
+    if not team:
         return None
     
     # Проверяем права на удаление (только владелец может удалять)
@@ -415,18 +494,44 @@ def remove_member_from_team(db: Session, team_id: int, user_id: int, remover_id:
     if user_id == team.owner_id:
         return None
     
+    return leave_team(db, user_id, team_id)
+
+def leave_team(db: Session, user_id: int, team_id: int = None):
+    """Вывести пользователя из команды (team_id - если он должен быть именно в этой команде)"""
+    user = _lock_user(db, user_id)
+    if not user or user.team_id is None or (team_id is not None and user.team_id != team_id):
+        db.rollback()
+        return None
+    team_id = user.team_id
+    
     user.team_id = None
+    adjust_team_stats(db, team_id, level_delta=-user.level, members_delta=-1)
     db.commit()
+    user_cache.invalidate_user(user_id)
     
     # Обновляем босса команды
     update_team_boss(db, team_id)
     
     db.refresh(user)
+    leaderboard.update_user(user)
     return user
 
 def get_team_members_count(db: Session, team_id: int):
-    """Получить количество участников команды"""
-    return db.query(models.User).filter(models.User.team_id == team_id).count()
+    """Получить количество участников команды (из счетчика команды)"""
+    return db.query(models.Team.members_count).filter(models.Team.team_id == team_id).scalar() or 0
+
+def adjust_team_stats(db: Session, team_id: int, level_delta: int = 0, members_delta: int = 0):
+    """Поправить счетчики команды (число участников и сумму уровней) в текущей транзакции.
+
+    Вызывается вместе с каждой сменой состава или уровня участника, поэтому выбору
+    босса не нужно читать всех участников. Расхождения исправляет python -m app.team_stats.
+    """
+    if team_id is None or (not level_delta and not members_delta):
+        return
+    db.query(models.Team).filter(models.Team.team_id == team_id).update({
+        "members_count": models.Team.members_count + members_delta,
+        "level_sum": models.Team.level_sum + level_delta,
+    }, synchronize_session=False)
 
 def update_team_boss_lives(db: Session, team_id: int, lives_change: int):
     db_team = get_team(db, team_id)
@@ -444,56 +549,43 @@ def update_team_boss(db: Session, team_id: int):
     if not team:
         return None
     
-    # Получаем всех участников команды
-    members = get_team_members(db, team_id)
+    assign_team_boss(db, team)
+    
+    db.commit()
+    db.refresh(team)
+    return team
+
+def assign_team_boss(db: Session, team: models.Team):
+    """Выбрать босса команды по числу участников и их среднему уровню (без коммита)"""
+    # Счетчики команды читаем из БД: в сессии они могут быть устаревшими
+    members_count, level_sum = db.query(
+        models.Team.members_count, models.Team.level_sum
+    ).filter(models.Team.team_id == team.team_id).one()
     
-    if len(members) < 2:
+    if members_count < 2:
         # Если участников меньше 2, убираем босса
         team.boss_id = None
         team.boss_lives = 0
     else:
         # Вычисляем средний уровень участников
-        avg_level = sum(member.level for member in members) / len(members)
+        avg_level = level_sum / members_count
         avg_level = int(round(avg_level))
         
-        # Определяем ID босса на основе среднего уровня
-        boss_id = get_boss_id_by_level(avg_level)
+        # Определяем босса на основе среднего уровня
+        boss = reference_cache.boss_tiers.get(db).for_level(avg_level)
         
         # Если босс изменился или его нет, назначаем нового
-        if team.boss_id != boss_id:
-            boss = get_boss(db, boss_id)
-            if boss:
-                team.boss_id = boss_id
-                team.boss_lives = boss.base_lives
-    
-    db.commit()
-    db.refresh(team)
-    return team
-
-def get_boss_id_by_level(avg_level: int) -> int:
-    """Определить ID босса на основе среднего уровня команды"""
-    if avg_level <= 10:
-        return 1
-    elif avg_level <= 20:
-        return 2
-    elif avg_level <= 30:
-        return 3
-    elif avg_level <= 40:
-        return 4
-    elif avg_level <= 50:
-        return 5
-    elif avg_level <= 60:
-        return 6
-    elif avg_level <= 70:
-        return 7
-    else:
-        return 8
+        if boss and team.boss_id != boss.boss_id:
+            team.boss_id = boss.boss_id
+            team.boss_lives = boss.base_lives
 
 # --- Boss CRUD ---
 def create_boss(db: Session, boss: schemas.BossCreate):
     db_boss = models.Boss(**boss.dict())
     db.add(db_boss)
     db.commit()
+    reference_cache.bosses_cache.invalidate()
+    reference_cache.boss_tiers.invalidate()
     db.refresh(db_boss)
     return db_boss
 
@@ -506,33 +598,116 @@ def get_bosses(db: Session, skip: int = 0, limit: int = 100):
 def defeat_boss(db: Session, team_id: int):
     """Обработка победы над боссом"""
     team = get_team(db, team_id)
-    if not team or not team.boss_id:
+    if not team:
+        return None
+    
+    result = apply_boss_defeat(db, team)
+    if result is None:
+        return None
+    db.commit()
+    user_cache.invalidate_team(team_id)
+    leaderboard.refresh_team(db, team_id)
+    
+    return result
+
+def apply_boss_defeat(db: Session, team: models.Team):
+    """Награда команде, снятие побежденного босса и выбор следующего (без коммита)"""
+    if not team.boss_id:
         return None
     
-    boss = team.boss
+    boss = reference_cache.boss_tiers.get(db).get(team.boss_id)
     if not boss:
         return None
     
-    # Выдаем награду всем участникам команды
-    members = db.query(models.User).filter(models.User.team_id == team_id).all()
-    for member in members:
-        db_useritems = get_user_items(db, member.user_id)
-        id_user_items = [id_items.item_id for id_items in db_useritems]
-        
-        if 15 in id_user_items:
-            reward = boss.gold_reward * 2
-            update_user_gold_xp(db, member.user_id, gold_change=reward)
-        
-        update_user_gold_xp(db, member.user_id, gold_change=boss.gold_reward)
+    # Выдаем награду всем участникам команды в одной транзакции
+    members_count = distribute_boss_rewards(db, team.team_id, boss.gold_reward)
     
     team.boss_id = None
     team.boss_lives = 0
-    db.commit()
+    team.boss_kills = (team.boss_kills or 0) + 1
+    db.flush()
     
     # Назначаем нового босса
-    update_team_boss(db, team_id)
-    
-    return {"boss_defeated": True, "gold_reward": boss.gold_reward, "members_count": len(members)}
+    assign_team_boss(db, team)
+    
+    return {"boss_defeated": True, "gold_reward": boss.gold_reward, "members_count": members_count}
+
+def record_boss_hit(db: Session, team_id: int, boss_id: int, observed_lives: int, damage: int):
+    """Учесть удар по боссу через накопитель урона.
+
+    observed_lives - здоровье босса, прочитанное из БД в этом запросе. Возвращает
+    (оценка текущего здоровья, результат победы или None). Если накопленный урон
+    добивает босса, он записывается сразу, чтобы победа была засчитана точно.
+    """
+    pending = boss_damage.accumulator.add(team_id, boss_id, damage)
+    estimated_lives = max(0, observed_lives - pending)
+    if estimated_lives > 0:
+        return estimated_lives, None
+    return flush_team_boss_damage(db, team_id)
+
+def apply_boss_damage(db: Session, team_id: int, boss_id: int, damage: int):
+    """Списать накопленный урон одной транзакцией; при победе - apply_boss_defeat.
+
+    Урон списывается условным UPDATE (только живому боссу с тем же boss_id), который
+    держит блокировку строки команды до коммита, поэтому победа засчитывается ровно
+    один раз, даже если урон одновременно списывают несколько воркеров. Урон по боссу,
+    которого уже сменили, отбрасывается. Возвращает (здоровье босса, результат победы или None).
+    """
+    Team = models.Team
+    applied = db.query(Team).filter(
+        Team.team_id == team_id, Team.boss_id == boss_id, Team.boss_lives > 0
+    ).update(
+        {"boss_lives": case((Team.boss_lives > damage, Team.boss_lives - damage), else_=0)},
+        synchronize_session=False
+    )
+    team = db.query(Team).filter(Team.team_id == team_id).populate_existing().first()
+    if not applied:
+        db.rollback()
+        boss_damage.accumulator.count("dropped_damage", damage)
+        return (team.boss_lives if team else 0), None
+    
+    defeat_result = None
+    if team.boss_lives == 0:
+        defeat_result = apply_boss_defeat(db, team)
+    boss_lives = team.boss_lives
+    db.commit()
+    boss_damage.accumulator.count("flushes")
+    if defeat_result:
+        user_cache.invalidate_team(team_id)
+        try:
+            leaderboard.refresh_team(db, team_id)
+        except Exception as e:
+            # Урон уже записан: ошибка обновления рейтинга не должна вернуть его в накопитель
+            print(f"Error refreshing leaderboard for team {team_id}: {e}")
+    return (0 if defeat_result else boss_lives), defeat_result
+
+def _try_apply_boss_damage(db: Session, team_id: int, boss_id: int, damage: int):
+    """apply_boss_damage, который при ошибке возвращает урон в накопитель; None - не записано"""
+    try:
+        return apply_boss_damage(db, team_id, boss_id, damage)
+    except Exception as e:
+        db.rollback()
+        # Не теряем урон: вернем его в накопитель до следующей попытки
+        boss_damage.accumulator.add(team_id, boss_id, damage, hits=0)
+        print(f"Error applying boss damage for team {team_id}: {e}")
+        return None
+
+def flush_team_boss_damage(db: Session, team_id: int):
+    """Сразу списать накопленный урон команды; возвращает результат последнего списания"""
+    result = None
+    for boss_id, damage in boss_damage.accumulator.take(team_id).items():
+        result = _try_apply_boss_damage(db, team_id, boss_id, damage) or result
+    if result is None:
+        # Урон уже забрал другой поток или запись не удалась - возвращаем текущее состояние
+        team = get_team(db, team_id)
+        result = ((team.boss_lives if team else 0), None)
+    return result
+
+def flush_boss_damage(db: Session):
+    """Списать накопленный урон всех команд (вызывается периодически)"""
+    for team_id, bosses in boss_damage.accumulator.take_all().items():
+        for boss_id, damage in bosses.items():
+            _try_apply_boss_damage(db, team_id, boss_id, damage)
 
 # --- Chat CRUD ---
 def create_chat_message(db: Session, team_id: int, user_id: int, message: str):
@@ -547,17 +722,70 @@ def create_chat_message(db: Session, team_id: int, user_id: int, message: str):
     db.refresh(db_message)
     return db_message
 
-def get_team_chat_messages(db: Session, team_id: int, skip: int = 0, limit: int = 50):
-    """Получить сообщения чата команды"""
-    return db.query(models.ChatMessage).options(
-        joinedload(models.ChatMessage.user)
+def _get_chat_cursor(db: Session, team_id: int, message_id: int):
+    """Позиция (timestamp, message_id) сообщения-курсора: в горячей таблице или в архиве"""
+    ChatMessage = models.ChatMessage
+    cursor = db.query(ChatMessage.timestamp, ChatMessage.message_id).filter(
+        ChatMessage.message_id == message_id, ChatMessage.team_id == team_id
+    ).first()
+    if cursor is not None:
+        return cursor.timestamp, cursor.message_id
+    return chat_archive.find_archived_position(db, team_id, message_id)
+
+def get_team_chat_messages(db: Session, team_id: int, limit: int = 50, before: int = None, after: int = None):
+    """Получить сообщения чата команды в хронологическом порядке.
+
+    Без курсора - последние limit сообщений; before/after - id сообщения,
+    до или после которого нужна страница (keyset-пагинация по индексу team_id, timestamp).
+    Старые сообщения дочитываются из архива (chat_archive), когда горячая таблица кончается.
+    """
+    ChatMessage = models.ChatMessage
+    position = tuple_(ChatMessage.timestamp, ChatMessage.message_id)
+    query = db.query(ChatMessage.message_id).filter(ChatMessage.team_id == team_id)
+    
+    if after is not None:
+        cursor = _get_chat_cursor(db, team_id, after)
+        if cursor is None:
+            return []
+        # Курсор может быть в архиве: начало страницы берем оттуда
+        archived = chat_archive.get_archived_messages(db, team_id, limit, after=cursor)
+        if archived:
+            cursor = (archived[-1]["timestamp"], archived[-1]["message_id"])
+        if len(archived) >= limit:
+            return archived
+        page = query.filter(position > tuple_(*cursor)).order_by(
+            ChatMessage.timestamp.asc(), ChatMessage.message_id.asc()
+        ).limit(limit - len(archived))
+    else:
+        archived = []
+        cursor = None
+        if before is not None:
+            cursor = _get_chat_cursor(db, team_id, before)
+            if cursor is None:
+                return []
+            query = query.filter(position < tuple_(*cursor))
+        # Берем последние limit сообщений, а в хронологический порядок разворачивает внешний запрос
+        page = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.message_id.desc()).limit(limit)
+    
+    messages = db.query(ChatMessage).options(
+        joinedload(ChatMessage.user)
     ).filter(
-        models.ChatMessage.team_id == team_id
-    ).order_by(models.ChatMessage.timestamp.desc()).offset(skip).limit(limit).all()
+        ChatMessage.message_id.in_(page.subquery().select())
+    ).order_by(ChatMessage.timestamp.asc(), ChatMessage.message_id.asc()).all()
+
+    if after is not None:
+        return archived + messages
+    if len(messages) < limit:
+        # Горячие сообщения кончились - дополняем страницу более старыми из архива
+        if messages:
+            cursor = (messages[0].timestamp, messages[0].message_id)
+        archived = chat_archive.get_archived_messages(db, team_id, limit - len(messages), before=cursor)
+    return archived + messages
 
 def delete_team_chat_messages(db: Session, team_id: int):
-    """Удалить все сообщения чата команды"""
-    db.query(models.ChatMessage).filter(models.ChatMessage.team_id == team_id).delete()
+    """Удалить все сообщения чата команды вместе с архивом"""
+    db.query(models.ChatMessage).filter(models.ChatMessage.team_id == team_id).delete(synchronize_session=False)
+    chat_archive.delete_team_archive(db, team_id)
     db.commit()
     
     
@@ -569,6 +797,12 @@ def get_catalog(db: Session, catalog_id: int):
 def get_user_catalogs(db: Session, user_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.Catalog).filter(models.Catalog.user_id == user_id).offset(skip).limit(limit).all()
 
+def get_catalog_tree(db: Session, user_id: int):
+    """Каталоги пользователя с задачами и днями повтора - три запроса независимо от их числа"""
+    return db.query(models.Catalog).options(
+        selectinload(models.Catalog.tasks).selectinload(models.Task.daily_tasks)
+    ).filter(models.Catalog.user_id == user_id).order_by(models.Catalog.catalog_id).all()
+
 def create_catalog(db: Session, catalog: schemas.CatalogCreate):
     db_catalog = models.Catalog(**catalog.dict())
     db.add(db_catalog)
@@ -590,15 +824,47 @@ def get_task(db: Session, task_id: int):
 def get_catalog_tasks(db: Session, catalog_id: int, skip: int = 0, limit: int = 100):
     return db.query(models.Task).filter(models.Task.catalog_id == catalog_id).offset(skip).limit(limit).all()
 
-def create_task(db: Session, task: schemas.TaskCreate):
+def _build_task(task: schemas.TaskCreate):
+    """Task вместе с DailyTask для дней повтора (без добавления в сессию)"""
     # Исключаем поля experience_reward и gold_reward, которых нет в модели Task
     task_data = task.dict(exclude={"experience_reward", "gold_reward", "repeat_days"})
     db_task = models.Task(**task_data)
+    for day in dict.fromkeys(task.repeat_days or []):
+        db_task.daily_tasks.append(models.DailyTask(day_week=day))
+    return db_task
+
+def create_task(db: Session, task: schemas.TaskCreate):
+    db_task = _build_task(task)
     db.add(db_task)
     db.commit()
     db.refresh(db_task)
     return db_task
 
+def user_owns_catalogs(db: Session, user_id: int, catalog_ids) -> bool:
+    """Все ли каталоги принадлежат пользователю (один запрос на весь набор)"""
+    catalog_ids = set(catalog_ids)
+    owned = db.query(models.Catalog.catalog_id).filter(
+        models.Catalog.catalog_id.in_(catalog_ids), models.Catalog.user_id == user_id
+    ).count()
+    return owned == len(catalog_ids)
+
+def create_tasks_bulk(db: Session, tasks: List[schemas.TaskCreate]):
+    """Создать задачи и их дни повтора в одной транзакции"""
+    db_tasks = [_build_task(task) for task in tasks]
+    db.add_all(db_tasks)
+    db.flush()
+    task_ids = [db_task.task_id for db_task in db_tasks]
+    db.commit()
+
+    # Перечитываем созданное двумя запросами вместо refresh каждой задачи
+    loaded = {
+        db_task.task_id: db_task
+        for db_task in db.query(models.Task).options(
+            selectinload(models.Task.daily_tasks)
+        ).filter(models.Task.task_id.in_(task_ids)).all()
+    }
+    return [loaded[task_id] for task_id in task_ids]
+
 def update_task(db: Session, task_id: int, task_update: schemas.TaskUpdate):
     db_task = get_task(db, task_id=task_id)
     if not db_task:
@@ -612,35 +878,61 @@ def update_task(db: Session, task_id: int, task_update: schemas.TaskUpdate):
     db.refresh(db_task)
     return db_task
 
-def update_task_completion(db: Session, task_id: int, completed: str, user_id: int):
-    db_task = get_task(db, task_id=task_id)
-    if not db_task:
-        return None
-    
-    user = get_user(db, user_id)
-    if not user:
-        return None
-    
-    # Если задача выполнена и пользователь в команде, наносим урон боссу
-    if completed == 'true' and user.team_id:
-        team = get_team(db, user.team_id)
-        if team and team.boss_id and team.boss_lives > 0:
-            damage = int(user.attack)
-            if user.class_id == 1:
-                boss = get_boss(db, team.boss_id)
-                damage = damage + boss.level
-            
-            new_lives = max(0, team.boss_lives - damage)
-            team.boss_lives = new_lives
-            
-            # Если босс побежден
-            if new_lives == 0:
-                defeat_boss(db, team.team_id)
+def get_task_owner(db: Session, task_id: int):
+    """Владелец каталога задачи и ее сложность одним запросом; None, если задачи нет"""
+    return db.query(models.Catalog.user_id, models.Task.complexity).join(
+        models.Task, models.Task.catalog_id == models.Catalog.catalog_id
+    ).filter(models.Task.task_id == task_id).first()
+
+def update_task_completion(db: Session, task_id: int, completed: str, user_id: int,
+                           gold_reward: int = 0, points_reward: int = 0):
+    """Сменить статус задачи; при выполнении - награда, повышение уровня и урон боссу.
+
+    Статус, награда и уровень меняются в одной транзакции. Статус меняется условным
+    UPDATE (только если он действительно другой и каталог принадлежит пользователю),
+    поэтому повторный или параллельный запрос не наградит дважды. Строка пользователя
+    блокируется (SELECT ... FOR UPDATE) только до единственного коммита. Урон боссу
+    уходит в накопитель (record_boss_hit) и не блокирует строку команды.
+    """
+    owned_catalogs = db.query(models.Catalog.catalog_id).filter(models.Catalog.user_id == user_id)
+    changed = db.query(models.Task).filter(
+        models.Task.task_id == task_id,
+        models.Task.completed != completed,
+        models.Task.catalog_id.in_(owned_catalogs.scalar_subquery()),
+    ).update({"completed": completed}, synchronize_session=False)
+    
+    hit = None
+    if changed and completed == 'true':
+        user = db.query(models.User).filter(
+            models.User.user_id == user_id
+        ).with_for_update().populate_existing().first()
+        
+        # Награда за задачу
+        user_modifiers = modifiers.get_user_modifiers(db, user)
+        gold, experience = user_modifiers.apply_rewards(gold_reward, points_reward)
+        user.gold += gold
+        user.points += experience
+        adjust_team_stats(db, user.team_id, level_delta=apply_level_up(user))
+        
+        # Если пользователь в команде, наносим урон боссу
+        if user.team_id:
+            team = db.query(models.Team.boss_id, models.Team.boss_lives).filter(
+                models.Team.team_id == user.team_id
+            ).first()
+            if team and team.boss_id and team.boss_lives > 0:
+                damage = int(user.attack)
+                if user.class_id == 1:
+                    boss = reference_cache.boss_tiers.get(db).get(team.boss_id)
+                    damage = damage + (boss.level if boss else 0)
+                hit = (user.team_id, team.boss_id, team.boss_lives, damage)
     
-    db_task.completed = completed
     db.commit()
-    db.refresh(db_task)
-    return db_task
+    if changed and completed == 'true':
+        user_cache.invalidate_user(user_id)
+        leaderboard.update_users(db, [user_id])
+    if hit:
+        record_boss_hit(db, *hit)
+    return get_task(db, task_id=task_id)
 
 
 def delete_task(db: Session, task_id: int):
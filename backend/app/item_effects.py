@@ -0,0 +1,98 @@
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .reference_cache import ReferenceCache
+
+# Эффекты предметов при активации, собранные по Item.bonus_type/bonus_data.
+# Расходуемые предметы применяются один раз и удаляются из инвентаря, постоянные
+# прибавляют к характеристикам, пока активны. Остальные типы бонусов (множители
+# наград, защита) только занимают слот - их учитывает modifiers.py.
+ACTIVE_ITEMS_LIMIT = 3
+
+
+@dataclass(frozen=True)
+class ItemEffect:
+    item_id: int
+    consumable: bool = False
+    lives_restore_percent: int = 0   # health_restore, health_restore_full
+    exp_boost_percent: int = 0       # exp_boost
+    max_lives: int = 0               # max_health (столько же добавляется к текущим жизням)
+    attack: int = 0                  # attack
+
+    def consume(self, user: models.User) -> int:
+        """Применить расходуемый предмет к пользователю; возвращает число новых уровней"""
+        if self.lives_restore_percent:
+            restored = user.lives + round(user.max_lives * self.lives_restore_percent / 100)
+            user.lives = min(restored, user.max_lives)
+        if self.exp_boost_percent:
+            points = user.points + round(user.max_points * self.exp_boost_percent / 100)
+            if points >= user.max_points:
+                user.points = 0
+                user.level += 1
+                user.max_points = 100 * user.level  # Формула опыта для уровней
+                user.attack += 1
+                return 1
+            user.points = points
+        return 0
+
+    def apply(self, user: models.User, sign: int = 1):
+        """Добавить (sign=1) или снять (sign=-1) прибавку активного предмета"""
+        if self.max_lives:
+            user.lives += sign * self.max_lives
+            user.max_lives += sign * self.max_lives
+        if self.attack:
+            user.attack += sign * self.attack
+
+
+def _compile_effect(item) -> ItemEffect:
+    value = item.bonus_data or 0
+    if item.bonus_type == "health_restore":
+        return ItemEffect(item.item_id, consumable=True, lives_restore_percent=value)
+    if item.bonus_type == "health_restore_full":
+        return ItemEffect(item.item_id, consumable=True, lives_restore_percent=100)
+    if item.bonus_type == "exp_boost":
+        return ItemEffect(item.item_id, consumable=True, exp_boost_percent=value)
+    if item.bonus_type == "max_health":
+        return ItemEffect(item.item_id, max_lives=value)
+    if item.bonus_type == "attack":
+        return ItemEffect(item.item_id, attack=value)
+    return ItemEffect(item.item_id)
+
+
+class ItemEffects:
+    """Неизменяемая таблица эффектов по item_id"""
+
+    def __init__(self, items):
+        self._by_id = MappingProxyType({item.item_id: _compile_effect(item) for item in items})
+        self.created_at = time.monotonic()
+
+    def get(self, item_id: int) -> Optional[ItemEffect]:
+        return self._by_id.get(item_id)
+
+
+class ItemEffectsCache(ReferenceCache):
+    """Таблица эффектов собирается при первом обращении и сбрасывается после create_item"""
+
+    def _build(self, rows):
+        return ItemEffects(rows)
+
+
+def _load_items(db: Session):
+    return db.query(models.Item).order_by(models.Item.item_id).all()
+
+
+effects = ItemEffectsCache("item_effects", _load_items, schemas.Item)
+
+
+def get_effect(db: Session, item_id: int) -> Optional[ItemEffect]:
+    """Эффект предмета; неизвестный id перечитывает таблицу (предмет мог добавить другой воркер)"""
+    effect = effects.get(db).get(item_id)
+    if effect is None:
+        effects.invalidate()
+        effect = effects.get(db).get(item_id)
+    return effect
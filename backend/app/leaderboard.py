@@ -0,0 +1,247 @@
+import asyncio
+import os
+import threading
+
+from sortedcontainers import SortedList
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+# Рейтинги пользователей и команд в памяти процесса. Изменения из crud применяются
+# сразу, а полная пересборка из БД - при старте и раз в LEADERBOARD_REBUILD_SECONDS,
+# чтобы подтянуть изменения, сделанные другими воркерами.
+LEADERBOARD_REBUILD_SECONDS = int(os.getenv("LEADERBOARD_REBUILD_SECONDS", "300"))
+
+
+class Leaderboard:
+    """Отсортированный рейтинг: позиция за O(log n), страница - без полного обхода.
+
+    sort_key(entity_id, entry) возвращает ключ по возрастанию (лучшие - первыми),
+    последний элемент ключа - entity_id.
+    """
+
+    def __init__(self, sort_key):
+        self.sort_key = sort_key
+        self._order = SortedList()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def update(self, entity_id: int, entry: dict):
+        """Заменить запись; возвращает прежнюю (или None)"""
+        with self._lock:
+            previous = self._remove(entity_id)
+            self._add(entity_id, entry)
+            return previous
+
+    def modify(self, entity_id: int, change, default: dict = None):
+        """Изменить запись за одну блокировку: change(entry) правит копию записи на месте.
+
+        Если записи нет, меняется копия default (без default - ничего не делаем).
+        Параллельные изменения одной записи не затирают друг друга.
+        """
+        with self._lock:
+            current = self._entries.get(entity_id)
+            if current is None and default is None:
+                return
+            entry = dict(current[1] if current else default)
+            change(entry)
+            self._remove(entity_id)
+            self._add(entity_id, entry)
+
+    def remove(self, entity_id: int):
+        """Удалить запись; возвращает прежнюю (или None)"""
+        with self._lock:
+            return self._remove(entity_id)
+
+    def _add(self, entity_id: int, entry: dict):
+        key = self.sort_key(entity_id, entry)
+        self._entries[entity_id] = (key, entry)
+        self._order.add(key)
+
+    def _remove(self, entity_id: int):
+        current = self._entries.pop(entity_id, None)
+        if current is None:
+            return None
+        self._order.remove(current[0])
+        return current[1]
+
+    def get(self, entity_id: int):
+        with self._lock:
+            current = self._entries.get(entity_id)
+            return dict(current[1]) if current else None
+
+    def position(self, entity_id: int):
+        """Запись вместе с местом в рейтинге (с 1) или None"""
+        with self._lock:
+            current = self._entries.get(entity_id)
+            if current is None:
+                return None
+            return {"rank": self._order.bisect_left(current[0]) + 1, **current[1]}
+
+    def page(self, skip: int = 0, limit: int = 50):
+        """Записи с местами skip+1 .. skip+limit"""
+        with self._lock:
+            keys = self._order.islice(skip, skip + limit)
+            return [
+                {"rank": skip + position + 1, **self._entries[key[-1]][1]}
+                for position, key in enumerate(keys)
+            ]
+
+    def __len__(self):
+        return len(self._order)
+
+    def replace_all(self, entries):
+        """Заменить рейтинг целиком; entries - пары (entity_id, entry)"""
+        built = {entity_id: (self.sort_key(entity_id, entry), entry) for entity_id, entry in entries}
+        order = SortedList(key for key, _ in built.values())
+        with self._lock:
+            self._entries = built
+            self._order = order
+
+
+# Пользователи: уровень, затем опыт; при равенстве - раньше зарегистрированный
+users = Leaderboard(lambda user_id, entry: (-entry["level"], -entry["points"], user_id))
+# Команды: побежденные боссы, затем суммарный уровень участников
+teams = Leaderboard(lambda team_id, entry: (-entry["boss_kills"], -entry["total_level"], team_id))
+
+
+def _user_entry(user) -> dict:
+    return {
+        "user_id": user.user_id,
+        "nickname": user.nickname,
+        "level": user.level,
+        "points": user.points,
+        "img": user.img,
+        "team_id": user.team_id,
+    }
+
+
+def update_user(user):
+    """Обновить пользователя (объект или строка с полями рейтинга) и сумму уровней его команды"""
+    # Замена записи атомарна, поэтому каждый переход previous -> user учитывается в суммах ровно раз
+    previous = users.update(user.user_id, _user_entry(user))
+    if previous and previous["team_id"] == user.team_id and previous["level"] == user.level:
+        return
+    # Команда или уровень изменились - поправляем суммы команд
+    if previous and previous["team_id"] is not None:
+        _adjust_team(previous["team_id"], -previous["level"], -1)
+    if user.team_id is not None:
+        _adjust_team(user.team_id, user.level, 1)
+
+
+def update_users(db: Session, user_ids):
+    """Перечитать пользователей из БД одним запросом и обновить рейтинг"""
+    if not user_ids:
+        return
+    for user in db.query(
+        models.User.user_id, models.User.nickname, models.User.level,
+        models.User.points, models.User.img, models.User.team_id
+    ).filter(models.User.user_id.in_(list(user_ids))):
+        update_user(user)
+
+
+def remove_user(user_id: int):
+    previous = users.remove(user_id)
+    if previous and previous["team_id"] is not None:
+        _adjust_team(previous["team_id"], -previous["level"], -1)
+
+
+def _adjust_team(team_id: int, level_delta: int, members_delta: int):
+    def change(entry):
+        entry["total_level"] += level_delta
+        entry["members_count"] += members_delta
+    teams.modify(team_id, change)
+
+
+def update_team(team, total_level: int = None, members_count: int = None):
+    """Обновить название и число побед команды (суммы берутся из текущей записи)"""
+    def change(entry):
+        entry.update({
+            "team_id": team.team_id,
+            "name": team.name,
+            "boss_kills": team.boss_kills or 0,
+        })
+        if total_level is not None:
+            entry["total_level"] = total_level
+        if members_count is not None:
+            entry["members_count"] = members_count
+    teams.modify(team.team_id, change, default={"total_level": 0, "members_count": 0})
+
+
+def refresh_team(db: Session, team_id: int):
+    """Перечитать команду и ее участников из БД (после смены состава или победы над боссом)"""
+    update_users(db, [row[0] for row in db.query(models.User.user_id).filter(models.User.team_id == team_id)])
+    row = _team_rows(db).filter(models.Team.team_id == team_id).first()
+    if row is None:
+        remove_team(team_id)
+        return
+    update_team(row, total_level=int(row.total_level), members_count=row.members_count)
+
+
+def remove_team(team_id: int):
+    teams.remove(team_id)
+
+
+def _team_rows(db: Session):
+    """Команды с суммой уровней и числом участников (счетчики из teams)"""
+    return db.query(
+        models.Team.team_id, models.Team.name, models.Team.boss_kills,
+        models.Team.level_sum.label("total_level"),
+        models.Team.members_count,
+    )
+
+
+def rebuild(db: Session):
+    """Пересобрать оба рейтинга из БД"""
+    user_rows = db.query(
+        models.User.user_id, models.User.nickname, models.User.level,
+        models.User.points, models.User.img, models.User.team_id
+    ).all()
+    team_rows = _team_rows(db).all()
+
+    users.replace_all((row.user_id, _user_entry(row)) for row in user_rows)
+    teams.replace_all(
+        (team_id, {
+            "team_id": team_id,
+            "name": name,
+            "boss_kills": boss_kills or 0,
+            "total_level": int(total_level),
+            "members_count": members_count,
+        })
+        for team_id, name, boss_kills, total_level, members_count in team_rows
+    )
+
+
+class LeaderboardRebuilder:
+    """Пересборка рейтингов при старте и периодически"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._task = None
+
+    def rebuild_once(self):
+        with self.session_factory() as db:
+            rebuild(db)
+
+    async def start(self):
+        await asyncio.to_thread(self.rebuild_once)
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(LEADERBOARD_REBUILD_SECONDS)
+            try:
+                await asyncio.to_thread(self.rebuild_once)
+            except Exception as e:
+                print(f"Error rebuilding leaderboards: {e}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
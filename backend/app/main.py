@@ -1,32 +1,75 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Request, APIRouter
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Request, APIRouter, Header, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.templating import Jinja2Templates 
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any, Optional, Literal
+from contextlib import asynccontextmanager
 from datetime import timedelta, date
 import random 
 import os 
-
-from . import crud, models, schemas, security
-from .database import SessionLocal, engine, get_db
+import secrets
+
+from . import crud, async_crud, models, schemas, security, user_cache, reference_cache, static_files, migrations, boss_damage, leaderboard, item_effects
+from .chat import TeamConnectionManager
+from .chat_broker import create_broker
+from .chat_persistence import ChatPersistencePipeline
+from .chat_archive import ChatArchiver
+from .boss_damage import BossDamageFlusher
+from .task_scheduler import TaskResetScheduler
+from .leaderboard import LeaderboardRebuilder
+from .database import SessionLocal, engine, get_db, get_async_db, get_pool_status, ASYNC_DATABASE_URL
 
 BACKEND_APP_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT_DIR = os.path.abspath(os.path.join(BACKEND_APP_DIR, "..")) 
 FRONTEND_DIR = os.path.abspath(os.path.join(PROJECT_ROOT_DIR, "..", "frontend")) 
+# Внутренние эндпоинты требуют заголовок X-Internal-Token; без токена они выключены (404)
+INTERNAL_METRICS_TOKEN = os.getenv("INTERNAL_METRICS_TOKEN")
 
 models.Base.metadata.create_all(bind=engine)
+migrations.run_migrations(engine)
+
+# Брокер чата: доставляет сообщения участникам, подключенным к другим воркерам
+chat_broker = create_broker(ASYNC_DATABASE_URL)
+# Пакетная запись сообщений из WebSocket-чата
+chat_pipeline = ChatPersistencePipeline()
+chat_archiver = ChatArchiver()
+boss_damage_flusher = BossDamageFlusher(crud.flush_boss_damage)
+task_reset_scheduler = TaskResetScheduler()
+leaderboard_rebuilder = LeaderboardRebuilder()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Таблица эффектов предметов собирается до первого запроса
+    with SessionLocal() as db:
+        item_effects.effects.get(db)
+    await chat_broker.start()
+    await chat_pipeline.start()
+    await chat_archiver.start()
+    await boss_damage_flusher.start()
+    await task_reset_scheduler.start()
+    await leaderboard_rebuilder.start()
+    yield
+    await leaderboard_rebuilder.stop()
+    await task_reset_scheduler.stop()
+    await boss_damage_flusher.stop()
+    await chat_archiver.stop()
+    await chat_pipeline.stop()
+    await chat_broker.stop()
 
 app = FastAPI(
     title="Gamify Planner API",
     description="Backend for the Gamified Planner application with FastAPI, OAuth2, and PostgreSQL, also serving frontend.",
-    version="0.1.1"
+    version="0.1.1",
+    lifespan=lifespan
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -40,35 +83,71 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(username=login)
     except security.jwt.PyJWTError:
         raise credentials_exception
-    user = crud.get_user_by_login(db, login=token_data.username)
+    # Снимок пользователя из кэша избавляет от запроса в БД на каждый вызов API
+    # (только для авторизации: данные пользователя эндпоинты читают из БД, см. user_cache)
+    cached_user = user_cache.get_cached_user(token_data.username)
+    if cached_user is not None:
+        return cached_user
+    generation = user_cache.current_generation()
+    user = await async_crud.get_user_by_login(db, login=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    return user_cache.cache_user(token_data.username, user, generation)
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     return current_user
 
 api_router = APIRouter()
 
+def snapshot_response(request: Request, cache: reference_cache.ReferenceCache, db: Session, skip: int, limit: int):
+    """Отдать справочные данные из снимка с ETag (304, если клиент уже имеет эту версию)"""
+    return conditional_json_response(request, cache.get(db), skip, limit)
+
+def conditional_json_response(request: Request, snapshot: reference_cache.Snapshot, skip: int = 0, limit: int = None):
+    etag = snapshot.etag(skip, limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if reference_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=snapshot.page(skip, limit), media_type="application/json", headers=headers)
+
+password_hashing_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many authentication requests, please retry",
+    headers={"Retry-After": "1"},
+)
+
 @api_router.post("/auth/register", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user_by_nickname = crud.get_user_by_nickname(db, nickname=user.nickname)
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user_by_nickname = await async_crud.get_user_by_nickname(db, nickname=user.nickname)
     if db_user_by_nickname:
         raise HTTPException(status_code=400, detail="Nickname already registered")
-    db_user_by_login = crud.get_user_by_login(db, login=user.login)
+    db_user_by_login = await async_crud.get_user_by_login(db, login=user.login)
     if db_user_by_login:
         raise HTTPException(status_code=400, detail="Login already taken")
-    return crud.create_user(db=db, user=user)
+    try:
+        hashed_password = await security.get_password_hash_async(user.password)
+    except security.PasswordHashingBusy:
+        raise password_hashing_busy_exception
+    return await async_crud.create_user(db=db, user=user, hashed_password=hashed_password)
 
 @api_router.post("/auth/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_login(db, login=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_user_by_login(db, login=form_data.username)
+    password_ok = False
+    if user:
+        try:
+            password_ok, new_hash = await security.verify_password_async(form_data.password, user.hashed_password)
+        except security.PasswordHashingBusy:
+            raise password_hashing_busy_exception
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect login or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Хеш со старыми параметрами (например, другим BCRYPT_ROUNDS) пересчитываем при входе
+    if new_hash:
+        await async_crud.update_user_password_hash(db, user.user_id, new_hash)
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(
         subject=user.login, expires_delta=access_token_expires
@@ -76,22 +155,27 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @api_router.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(get_current_active_user)):
-    return current_user
+async def read_users_me(current_user: models.User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_user(db, current_user.user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 @api_router.put("/users/me", response_model=schemas.User)
-async def update_user_me(
+def update_user_me(
     user_update: schemas.UserUpdate, 
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(get_current_active_user)
 ):
-    if user_update.login and user_update.login != current_user.login:
+    if "team_id" in user_update.model_fields_set:
+        raise HTTPException(status_code=400, detail="Use team endpoints to join or leave a team")
+    if user_update.login:
         existing_user = crud.get_user_by_login(db, login=user_update.login)
-        if existing_user:
+        if existing_user and existing_user.user_id != current_user.user_id:
             raise HTTPException(status_code=400, detail="Login already taken")
-    if user_update.nickname and user_update.nickname != current_user.nickname:
+    if user_update.nickname:
         existing_user = crud.get_user_by_nickname(db, nickname=user_update.nickname)
-        if existing_user:
+        if existing_user and existing_user.user_id != current_user.user_id:
             raise HTTPException(status_code=400, detail="Nickname already registered")
     updated_user = crud.update_user_profile(db=db, user_id=current_user.user_id, user_update=user_update)
     if not updated_user:
@@ -116,16 +200,13 @@ def update_current_user_lives(
                     detail="Lives must be an integer value"
                 )
         
-        # Обновляем значение жизней
-        current_user.lives = user_update.lives
-        print(current_user.lives)
-        
-        return crud.decrease_user_lives(db, current_user.user_id, current_user.lives)
+        # Новое значение жизней пишется через сессию запроса (current_user - снимок из кэша)
+        return crud.decrease_user_lives(db, current_user.user_id, user_update.lives)
 
 # --- Class endpoints ---
 @api_router.get("/classes/", response_model=List[schemas.Class])
-def get_all_classes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_classes(db, skip=skip, limit=limit)
+def get_all_classes(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return snapshot_response(request, reference_cache.classes_cache, db, skip, limit)
 
 @api_router.get("/classes/{class_id}", response_model=schemas.Class)
 def get_class_details(class_id: int, db: Session = Depends(get_db)):
@@ -137,8 +218,8 @@ def get_class_details(class_id: int, db: Session = Depends(get_db)):
 # --- Item endpoints ---
 
 @api_router.get("/items", response_model=List[schemas.Item])  # Убрал завершающий слеш
-def get_all_items_in_shop(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_items(db, skip=skip, limit=limit)
+def get_all_items_in_shop(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return snapshot_response(request, reference_cache.items_cache, db, skip, limit)
 
 @api_router.get("/items/{item_id}", response_model=schemas.Item)
 def get_shop_item_details(item_id: int, db: Session = Depends(get_db)):
@@ -147,90 +228,54 @@ def get_shop_item_details(item_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Item not found in shop")
     return db_item
 
+# Ответы на покупку по итогу crud.purchase_item
+PURCHASE_MESSAGES = {
+    "purchased": "Successfully purchased {name}",
+    "owned": "You already own {name}",
+    "wrong_class": "{name} is not available for your class",
+    "insufficient_gold": "Not enough gold to buy {name}",
+}
+
 @api_router.post("/items/buy", response_model=schemas.BuyItemResponse)
 async def buy_item(
     buy_request: schemas.BuyItemRequest,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None, max_length=64)
 ):
-    # Получаем предмет из базы данных
-    item_to_buy = crud.get_item(db, item_id=buy_request.item_id)
-    item_data = {
-    "item_id": item_to_buy.item_id,
-    "name": item_to_buy.name,
-    "price": item_to_buy.price,
-    "information": item_to_buy.information,
-    "type": item_to_buy.type,
-    "class_id": item_to_buy.class_id,
-    "bonus_type": item_to_buy.bonus_type,
-    "bonus_data": item_to_buy.bonus_data
-    }
-    if item_to_buy is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Item not found in shop"
-        )
-    
-    # Проверяем, есть ли у пользователя уже этот предмет
-    existing_user_item = crud.get_user_item(db, user_id=current_user.user_id, item_id=buy_request.item_id)
-    if existing_user_item:
-        return schemas.BuyItemResponse(
-            success=True,
-            message=f"Successfully purchased {item_to_buy.name}",
-            user_gold=current_user.gold,
-            item=item_data
-        )
-    
-    # Проверяем, достаточно ли у пользователя золота
-    if current_user.gold < item_to_buy.price:
-        return schemas.BuyItemResponse(
-            success=True,
-            message=f"Successfully purchased {item_to_buy.name}",
-            user_gold=current_user.gold,
-            item=item_data
-        )
-    
-    # Проверяем, соответствует ли предмет классу пользователя (если это классовый предмет)
-    if item_to_buy.class_id is not None and item_to_buy.class_id != current_user.class_id:
-        return schemas.BuyItemResponse(
-            success=True,
-            message=f"Successfully purchased {item_to_buy.name}",
-            user_gold=current_user.gold,
-            item=item_data
-        )
-    
     try:
-        # Списываем золото у пользователя
-        updated_user = crud.update_user_gold_xp(
-            db, 
-            user_id=current_user.user_id, 
-            gold_change=-item_to_buy.price
-        )
-        
-        # Добавляем предмет в инвентарь пользователя
-        user_item = crud.add_item_to_user_inventory(
-            db, 
-            user_id=current_user.user_id, 
-            item_id=buy_request.item_id
-        )
-        
-        # Обновляем данные пользователя
-        db.refresh(current_user)
-        
-        return schemas.BuyItemResponse(
-            success=True,
-            message=f"Successfully purchased {item_to_buy.name}",
-            user_gold=current_user.gold,
-            item=item_data
+        # Списание золота и добавление предмета - одна транзакция (синхронный crud через run_sync)
+        result = await db.run_sync(
+            crud.purchase_item,
+            user_id=current_user.user_id,
+            item_id=buy_request.item_id,
+            idempotency_key=idempotency_key
         )
-    
     except Exception as e:
         # В случае ошибки откатываем транзакцию
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to purchase item: {str(e)}"
         )
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Item not found in shop"
+        )
+    if result["status"] == "key_reused":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Idempotency key was already used for another item"
+        )
+    
+    return schemas.BuyItemResponse(
+        success=result["status"] == "purchased",
+        message=PURCHASE_MESSAGES[result["status"]].format(name=result["item"]["name"]),
+        user_gold=result["user_gold"],
+        item=result["item"]
+    )
 
 # --- UserItem endpoints ---
 @api_router.get("/user-items", response_model=List[schemas.UserItem])
@@ -239,17 +284,14 @@ def get_my_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
 
 @api_router.post("/user-items/buy/{item_id}", response_model=schemas.UserItem)
 def buy_item_from_shop(item_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
-    item_to_buy = crud.get_item(db, item_id=item_id)
-    if item_to_buy is None:
+    result = crud.purchase_item(db, user_id=current_user.user_id, item_id=item_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="Item not found in shop")
-    if current_user.gold < item_to_buy.price:
-        raise HTTPException(status_code=400, detail="Not enough gold")
-    crud.update_user_gold_xp(db, user_id=current_user.user_id, gold_change=-item_to_buy.price)
-    user_item = crud.add_item_to_user_inventory(db, user_id=current_user.user_id, item_id=item_id)
-    db.refresh(current_user)
-    return user_item
-
-@api_router.put("/user-items/{item_id}/toggle-active", response_model=schemas.UserItem)
+    if result["status"] not in ("purchased", "owned"):
+        raise HTTPException(status_code=400, detail=PURCHASE_MESSAGES[result["status"]].format(name=result["item"]["name"]))
+    return crud.get_user_item(db, user_id=current_user.user_id, item_id=item_id)
+
+@api_router.put("/user-items/{item_id}/toggle-active", response_model=Optional[schemas.UserItem])
 def toggle_item_active_status(
     item_id: int, 
     active_status: schemas.UserItemUpdate, 
@@ -261,10 +303,14 @@ def toggle_item_active_status(
         raise HTTPException(status_code=404, detail="Item not found in your inventory")
     if active_status.active is None:
         raise HTTPException(status_code=400, detail="Active status must be provided ('true' or 'false')")
+    if item_effects.get_effect(db, item_id) is None:
+        raise HTTPException(status_code=404, detail="Item not found in shop")
     updated_user_item = crud.update_user_item_active_status(
         db=db, user_id=current_user.user_id, item_id=item_id, active=active_status.active
     )
-    db.refresh(current_user)
+    # None - расходуемый предмет применен и удален из инвентаря
+    if updated_user_item is not None and updated_user_item.active != active_status.active:
+        raise HTTPException(status_code=400, detail="All active item slots are taken")
     return updated_user_item
 
 @api_router.get("/teams/my-team", response_model=schemas.TeamResponse)
@@ -272,10 +318,11 @@ def get_my_team(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    if not current_user.team_id:
+    team_id = crud.get_user_team_id(db, current_user.user_id)
+    if not team_id:
         raise HTTPException(status_code=404, detail="You are not in a team")
     
-    team = crud.get_team(db, current_user.team_id)
+    team = crud.get_team(db, team_id)
     if not team:
         raise HTTPException(status_code=404, detail="Team not found")
     
@@ -305,7 +352,7 @@ def create_team(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Проверяем, что пользователь не в команде
-    if current_user.team_id is not None:
+    if crud.get_user_team_id(db, current_user.user_id) is not None:
         raise HTTPException(status_code=400, detail="You are already in a team")
     
     # Проверяем, что команда с таким именем не существует
@@ -313,7 +360,10 @@ def create_team(
     if existing_team:
         raise HTTPException(status_code=400, detail="Team with this name already exists")
     
-    return crud.create_team(db=db, team=team, owner_id=current_user.user_id)
+    db_team = crud.create_team(db=db, team=team, owner_id=current_user.user_id)
+    if db_team is None:
+        raise HTTPException(status_code=400, detail="You are already in a team")
+    return db_team
 
 @api_router.get("/teams", response_model=List[schemas.Team])
 def get_all_teams(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
@@ -374,7 +424,7 @@ def join_team(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Проверяем, что пользователь не в команде
-    if current_user.team_id is not None:
+    if crud.get_user_team_id(db, current_user.user_id) is not None:
         raise HTTPException(status_code=400, detail="You are already in a team")
     
     # Ищем команду по имени
@@ -396,7 +446,7 @@ def leave_team(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Проверяем, что пользователь в этой команде
-    if current_user.team_id != team_id:
+    if crud.get_user_team_id(db, current_user.user_id) != team_id:
         raise HTTPException(status_code=400, detail="You are not in this team")
     
     team = crud.get_team(db, team_id)
@@ -484,8 +534,8 @@ def create_new_boss(boss: schemas.BossCreate, db: Session = Depends(get_db)):
     return crud.create_boss(db=db, boss=boss)
 
 @api_router.get("/bosses", response_model=List[schemas.Boss])
-def list_available_bosses(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_bosses(db, skip=skip, limit=limit)
+def list_available_bosses(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return snapshot_response(request, reference_cache.bosses_cache, db, skip, limit)
 
 @api_router.get("/bosses/{boss_id}", response_model=schemas.Boss)
 def get_boss_details(boss_id: int, db: Session = Depends(get_db)):
@@ -500,8 +550,9 @@ def attack_team_boss(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Проверяем, что пользователь в этой команде
-    if current_user.team_id != team_id:
+    # Проверяем, что пользователь в этой команде (команда и атака - из БД, не из снимка)
+    user = crud.get_user(db, current_user.user_id)
+    if user is None or user.team_id != team_id:
         raise HTTPException(status_code=403, detail="You are not a member of this team")
     
     team = crud.get_team(db, team_id)
@@ -519,26 +570,18 @@ def attack_team_boss(
         raise HTTPException(status_code=404, detail="Boss not found")
     
     # Вычисляем урон
-    damage = current_user.attack
+    damage = user.attack
     
-    # Наносим урон боссу
-    new_lives = max(0, team.boss_lives - damage)
-    team.boss_lives = new_lives
+    # Урон копится и списывается пачками; добивающий удар записывается сразу
+    new_lives, defeat_result = crud.record_boss_hit(db, team_id, team.boss_id, team.boss_lives, damage)
     
-    boss_defeated = False
+    boss_defeated = defeat_result is not None
     rewards = None
-    
-    # Проверяем победу над боссом
-    if new_lives == 0:
-        boss_defeated = True
-        defeat_result = crud.defeat_boss(db, team_id)
-        if defeat_result:
-            rewards = {
-                "gold": defeat_result["gold_reward"],
-                "members_rewarded": defeat_result["members_count"]
-            }
-    
-    db.commit()
+    if defeat_result:
+        rewards = {
+            "gold": defeat_result["gold_reward"],
+            "members_rewarded": defeat_result["members_count"]
+        }
     
     return schemas.BossAttackResult(
         message=f"You dealt {damage} damage to {boss.name}!",
@@ -549,21 +592,55 @@ def attack_team_boss(
         rewards_granted=rewards
     )
 
+# --- Leaderboard endpoints ---
+LEADERBOARD_PAGE_LIMIT = 100
+
+@api_router.get("/leaderboard/users", response_model=schemas.UserLeaderboard)
+def get_users_leaderboard(skip: int = 0, limit: int = 50, current_user: models.User = Depends(get_current_active_user)):
+    limit = max(0, min(limit, LEADERBOARD_PAGE_LIMIT))
+    return {"total": len(leaderboard.users), "entries": leaderboard.users.page(max(skip, 0), limit)}
+
+@api_router.get("/leaderboard/users/me", response_model=schemas.LeaderboardUserEntry)
+def get_my_leaderboard_position(current_user: models.User = Depends(get_current_active_user)):
+    position = leaderboard.users.position(current_user.user_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="User is not ranked yet")
+    return position
+
+@api_router.get("/leaderboard/teams", response_model=schemas.TeamLeaderboard)
+def get_teams_leaderboard(skip: int = 0, limit: int = 50, current_user: models.User = Depends(get_current_active_user)):
+    limit = max(0, min(limit, LEADERBOARD_PAGE_LIMIT))
+    return {"total": len(leaderboard.teams), "entries": leaderboard.teams.page(max(skip, 0), limit)}
+
+@api_router.get("/leaderboard/teams/my-team", response_model=schemas.LeaderboardTeamEntry)
+def get_my_team_leaderboard_position(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
+    team_id = crud.get_user_team_id(db, current_user.user_id)
+    if not team_id:
+        raise HTTPException(status_code=404, detail="You are not in a team")
+    position = leaderboard.teams.position(team_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Team is not ranked yet")
+    return position
+
 # --- Chat endpoints ---
 @api_router.get("/teams/{team_id}/chat", response_model=List[schemas.ChatMessage])
 def get_team_chat(
     team_id: int,
-    skip: int = 0,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    after: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Проверяем, что пользователь в этой команде
-    if current_user.team_id != team_id:
+    if crud.get_user_team_id(db, current_user.user_id) != team_id:
         raise HTTPException(status_code=403, detail="You are not a member of this team")
     
-    messages = crud.get_team_chat_messages(db, team_id, skip, limit)
-    return messages[::-1]  # Возвращаем в хронологическом порядке
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    
+    # Сообщения уже в хронологическом порядке
+    return crud.get_team_chat_messages(db, team_id, limit=limit, before=before, after=after)
 
 @api_router.post("/teams/{team_id}/chat", response_model=schemas.ChatMessage)
 def send_chat_message(
@@ -573,7 +650,7 @@ def send_chat_message(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Проверяем, что пользователь в этой команде
-    if current_user.team_id != team_id:
+    if crud.get_user_team_id(db, current_user.user_id) != team_id:
         raise HTTPException(status_code=403, detail="You are not a member of this team")
     
     # Создаем сообщение
@@ -591,6 +668,13 @@ def create_catalog(catalog_data: schemas.CatalogCreate, db: Session = Depends(ge
 def get_user_catalogs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
     return crud.get_user_catalogs(db, user_id=current_user.user_id, skip=skip, limit=limit)
 
+@api_router.get("/catalogs/tree", response_model=List[schemas.Catalog])
+def get_catalog_tree(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
+    # Все каталоги с задачами одним ответом; ETag - хэш тела, неизменившееся дерево отдается как 304
+    catalogs = crud.get_catalog_tree(db, user_id=current_user.user_id)
+    snapshot = reference_cache.Snapshot([jsonable_encoder(schemas.Catalog.from_orm(catalog)) for catalog in catalogs])
+    return conditional_json_response(request, snapshot)
+
 @api_router.get("/catalogs/{catalog_id}", response_model=schemas.Catalog)
 def get_catalog_details(catalog_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
     db_catalog = crud.get_catalog(db, catalog_id=catalog_id)
@@ -621,6 +705,13 @@ def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db), current
         raise HTTPException(status_code=403, detail="Not authorized to add tasks to this catalog")
     return crud.create_task(db=db, task=task)
 
+@api_router.post("/tasks/bulk", response_model=List[schemas.Task], status_code=status.HTTP_201_CREATED)
+def create_tasks_bulk(bulk: schemas.TaskBulkCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
+    # Одна проверка владения на все каталоги из запроса
+    if not crud.user_owns_catalogs(db, current_user.user_id, [task.catalog_id for task in bulk.tasks]):
+        raise HTTPException(status_code=403, detail="Not authorized to add tasks to this catalog")
+    return crud.create_tasks_bulk(db=db, tasks=bulk.tasks)
+
 @api_router.get("/catalogs/{catalog_id}/tasks", response_model=List[schemas.Task])
 def get_catalog_tasks(catalog_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
     # Verify catalog belongs to user
@@ -708,12 +799,10 @@ def update_task_completion(
     current_user: models.User = Depends(get_current_active_user)
 ):
     # Verify task belongs to user's catalog
-    task = crud.get_task(db, task_id=task_id)
-    if not task:
+    task = crud.get_task_owner(db, task_id=task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    
-    catalog = crud.get_catalog(db, catalog_id=task.catalog_id)
-    if not catalog or catalog.user_id != current_user.user_id:
+    if task.user_id != current_user.user_id:
         raise HTTPException(status_code=403, detail="Not authorized to update this task")
     
     if completed_status.completed is None:
@@ -725,57 +814,32 @@ def update_task_completion(
         "hard": [50, 80]
     }
     
-    updated_task = crud.update_task_completion(db=db, task_id=task_id, completed=completed_status.completed, user_id=current_user.user_id)
-    crud.update_user_gold_xp(
-        db,
+    # Урон боссу, награда и повышение уровня - одной транзакцией внутри crud
+    return crud.update_task_completion(
+        db=db,
+        task_id=task_id,
+        completed=completed_status.completed,
         user_id=current_user.user_id,
-        gold_change=rewards[task.complexity][0],
-        points_change=rewards[task.complexity][1])
-    return updated_task
+        gold_reward=rewards[task.complexity][0],
+        points_reward=rewards[task.complexity][1],
+    )
 
 # --- WebSocket для чата ---
-class TeamConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-    
-    async def connect(self, websocket: WebSocket, team_id: int):
-        await websocket.accept()
-        if team_id not in self.active_connections:
-            self.active_connections[team_id] = []
-        self.active_connections[team_id].append(websocket)
-    
-    def disconnect(self, websocket: WebSocket, team_id: int):
-        if team_id in self.active_connections:
-            if websocket in self.active_connections[team_id]:
-                self.active_connections[team_id].remove(websocket)
-            if not self.active_connections[team_id]:
-                del self.active_connections[team_id]
-    
-    async def send_to_team(self, message: str, team_id: int):
-        if team_id in self.active_connections:
-            for connection in self.active_connections[team_id]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    # Удаляем неактивные соединения
-                    if connection in self.active_connections[team_id]:
-                        self.active_connections[team_id].remove(connection)
-
-team_manager = TeamConnectionManager()
+team_manager = TeamConnectionManager(chat_broker, scope="team")
 
 @api_router.websocket("/ws/team-chat/{team_id}/{token}")
 async def team_chat_websocket(
     websocket: WebSocket, 
     team_id: int, 
     token: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         # Проверяем токен
         user = await get_current_user(token=token, db=db)
         
         # Проверяем, что пользователь в команде
-        if user.team_id != team_id:
+        if await async_crud.get_user_team_id(db, user.user_id) != team_id:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
             
@@ -789,8 +853,8 @@ async def team_chat_websocket(
         while True:
             data = await websocket.receive_text()
             
-            # Сохраняем сообщение в базе данных
-            message = crud.create_chat_message(db, team_id, user.user_id, data)
+            # Сохраняем сообщение в базе данных (пакетами, в фоне)
+            await chat_pipeline.submit(team_id, user.user_id, data)
             
             # Отправляем сообщение всем участникам команды
             formatted_message = f"{user.nickname}: {data}"
@@ -803,28 +867,7 @@ async def team_chat_websocket(
         team_manager.disconnect(websocket, team_id)
 
 # --- Старый чат WebSocket (сохраняем для совместимости) ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-    
-    async def connect(self, websocket: WebSocket, room_name: str):
-        await websocket.accept()
-        if room_name not in self.active_connections:
-            self.active_connections[room_name] = []
-        self.active_connections[room_name].append(websocket)
-    
-    def disconnect(self, websocket: WebSocket, room_name: str):
-        if room_name in self.active_connections:
-            self.active_connections[room_name].remove(websocket)
-            if not self.active_connections[room_name]:
-                del self.active_connections[room_name]
-    
-    async def broadcast(self, message: str, room_name: str):
-        if room_name in self.active_connections:
-            for connection in self.active_connections[room_name]:
-                await connection.send_text(message)
-
-manager = ConnectionManager()
+manager = TeamConnectionManager(chat_broker, scope="room")
 
 # Simplified chat message schema for WebSocket
 class ChatMessageBase(schemas.BaseModel):
@@ -836,7 +879,7 @@ class ChatMessage(ChatMessageBase):
     timestamp: str
 
 @api_router.websocket("/ws/chat/{room_name}/{token}")
-async def websocket_endpoint(websocket: WebSocket, room_name: str, token: str, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, room_name: str, token: str, db: AsyncSession = Depends(get_async_db)):
     try:
         user = await get_current_user(token=token, db=db)
     except HTTPException:
@@ -844,46 +887,66 @@ async def websocket_endpoint(websocket: WebSocket, room_name: str, token: str, d
         return
     
     await manager.connect(websocket, room_name)
-    await manager.broadcast(f"User {user.nickname} joined room '{room_name}'.", room_name)
+    await manager.send_to_team(f"User {user.nickname} joined room '{room_name}'.", room_name)
     
     try:
         while True:
             data = await websocket.receive_text()
-            await manager.broadcast(f"{user.nickname}: {data}", room_name)
+            await manager.send_to_team(f"{user.nickname}: {data}", room_name)
     except WebSocketDisconnect:
         manager.disconnect(websocket, room_name)
-        await manager.broadcast(f"User {user.nickname} left room '{room_name}'.", room_name)
+        await manager.send_to_team(f"User {user.nickname} left room '{room_name}'.", room_name)
     except Exception as e:
         print(f"Error in websocket: {e}")
         manager.disconnect(websocket, room_name)
-        await manager.broadcast(f"User {user.nickname} disconnected due to an error.", room_name)
+        await manager.send_to_team(f"User {user.nickname} disconnected due to an error.", room_name)
+
+# --- Internal endpoints ---
+def verify_internal_token(x_internal_token: Optional[str] = Header(None)):
+    if not INTERNAL_METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_internal_token is None or not secrets.compare_digest(x_internal_token, INTERNAL_METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+
+@api_router.get("/internal/metrics", include_in_schema=False, dependencies=[Depends(verify_internal_token)])
+def get_internal_metrics():
+    return {
+        "db_pool": get_pool_status(),
+        "password_hashing": security.get_password_hashing_stats(),
+        "team_chat": team_manager.get_stats(),
+        "chat_persistence": chat_pipeline.get_stats(),
+        "chat_archive": chat_archiver.get_stats(),
+        "boss_damage": boss_damage.accumulator.get_stats(),
+        "task_reset": task_reset_scheduler.get_stats(),
+    }
 
 # Подключаем API роутер
 app.include_router(api_router, prefix="/api")
 
 # Обслуживание фронтенда
+static_index = static_files.StaticIndex(FRONTEND_DIR).build()
+
+def static_asset_response(request: Request, asset: static_files.StaticAsset):
+    if asset.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=asset.headers())
+    if asset.content is None:
+        return FileResponse(asset.file_path, media_type=asset.media_type, headers=asset.headers())
+    encoding = asset.choose_encoding(request.headers.get("accept-encoding"))
+    content = asset.variants[encoding] if encoding else asset.content
+    return Response(content=content, media_type=asset.media_type, headers=asset.headers(encoding))
+
 @app.get("/{path:path}", response_class=HTMLResponse)
 async def serve_frontend_page(request: Request, path: str):
-    file_path = os.path.join(FRONTEND_DIR, path)
-    if os.path.isdir(file_path):
-        index_path = os.path.join(file_path, "index.html")
-        if os.path.exists(index_path):
-            return FileResponse(index_path, media_type="text/html")
-        raise HTTPException(status_code=404, detail="Directory listing not supported or index.html not found")
+    asset = static_index.lookup(path)
+    if asset is not None:
+        return static_asset_response(request, asset)
     
-    if os.path.exists(file_path):
-        media_type = "text/html" 
-        if path.endswith(".css"): media_type = "text/css"
-        elif path.endswith(".js"): media_type = "application/javascript"
-        elif path.endswith(".png"): media_type = "image/png"
-        elif path.endswith(".jpg") or path.endswith(".jpeg"): media_type = "image/jpeg"
-        elif path.endswith(".svg"): media_type = "image/svg+xml"
-        elif path.endswith(".json"): media_type = "application/json"
-        return FileResponse(file_path, media_type=media_type)
+    if static_index.is_directory(path):
+        raise HTTPException(status_code=404, detail="Directory listing not supported or index.html not found")
     
     # If specific file not found, try to serve index.html for SPA routing
-    index_path = os.path.join(FRONTEND_DIR, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path, media_type="text/html")
+    index_asset = static_index.lookup("index.html")
+    if index_asset is not None:
+        return static_asset_response(request, index_asset)
     
-    raise HTTPException(status_code=404, detail=f"File {path} not found")
\ No newline at end of file
+    raise HTTPException(status_code=404, detail=f"File {path} not found")
@@ -0,0 +1,126 @@
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+# Версионированные миграции схемы.
+# create_all создает только новые таблицы (вместе с их индексами), а индексы и
+# колонки для уже существующих таблиц добавляются здесь. Каждая миграция
+# выполняется один раз, номер записывается в schema_migrations.
+
+
+def _create_chat_messages_team_timestamp_index(connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_team_id_timestamp "
+        "ON chat_messages (team_id, timestamp, message_id)"
+    ))
+
+
+# Индексы по внешним ключам и полям, по которым фильтрует crud.py
+FOREIGN_KEY_INDEXES = [
+    ("ix_tasks_catalog_id", "tasks", "catalog_id"),
+    ("ix_catalogs_user_id", "catalogs", "user_id"),
+    ("ix_users_team_id", "users", "team_id"),
+    ("ix_user_items_user_id_active", "user_items", "user_id, active"),
+    ("ix_daily_task_task_id", "daily_task", "task_id"),
+    ("ix_teams_name", "teams", "name"),
+]
+
+
+def _create_foreign_key_indexes(connection):
+    for index_name, table, columns in FOREIGN_KEY_INDEXES:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})"))
+
+
+def _add_teams_boss_kills(connection):
+    # Новая база уже получила колонку через create_all
+    if "boss_kills" in {column["name"] for column in inspect(connection).get_columns("teams")}:
+        return
+    connection.execute(text("ALTER TABLE teams ADD COLUMN boss_kills INTEGER NOT NULL DEFAULT 0"))
+
+
+def _add_teams_member_stats(connection):
+    columns = {column["name"] for column in inspect(connection).get_columns("teams")}
+    for column in ("members_count", "level_sum"):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE teams ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+    # Заполняем счетчики существующих команд (то же делает python -m app.team_stats)
+    connection.execute(text(TEAM_STATS_BACKFILL_SQL))
+
+
+# Пересчет счетчиков участников всех команд одним запросом
+TEAM_STATS_BACKFILL_SQL = (
+    "UPDATE teams SET "
+    "members_count = (SELECT COUNT(*) FROM users WHERE users.team_id = teams.team_id), "
+    "level_sum = (SELECT COALESCE(SUM(users.level), 0) FROM users WHERE users.team_id = teams.team_id)"
+)
+
+
+def _add_chat_archive_id_range(connection):
+    columns = {column["name"] for column in inspect(connection).get_columns("chat_archive_blocks")}
+    for column in ("min_message_id", "max_message_id"):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE chat_archive_blocks ADD COLUMN {column} INTEGER"))
+    # Диапазон id существующих блоков - по их содержимому
+    blocks = connection.execute(text(
+        "SELECT block_id, data FROM chat_archive_blocks WHERE min_message_id IS NULL"
+    )).all()
+    for block_id, data in blocks:
+        ids = [row[0] for row in json.loads(zlib.decompress(data))]
+        connection.execute(
+            text("UPDATE chat_archive_blocks SET min_message_id = :min_id, max_message_id = :max_id WHERE block_id = :block_id"),
+            {"min_id": min(ids), "max_id": max(ids), "block_id": block_id}
+        )
+
+
+# Ключ advisory-блокировки: воркеры, стартующие одновременно, применяют миграции по очереди
+MIGRATIONS_LOCK_ID = 7311042
+
+MIGRATIONS = [
+    (1, "chat_messages_team_timestamp_index", _create_chat_messages_team_timestamp_index),
+    (2, "foreign_key_indexes", _create_foreign_key_indexes),
+    (3, "teams_boss_kills", _add_teams_boss_kills),
+    (4, "teams_member_stats", _add_teams_member_stats),
+    (5, "chat_archive_id_range", _add_chat_archive_id_range),
+]
+
+
+def _lock(connection) -> bool:
+    """Взять advisory-блокировку до конца транзакции (только PostgreSQL)"""
+    if connection.dialect.name != "postgresql":
+        return False
+    connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATIONS_LOCK_ID})
+    return True
+
+
+def run_migrations(engine: Engine):
+    """Применить миграции, которых еще нет в schema_migrations"""
+    with engine.begin() as connection:
+        _lock(connection)
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "name VARCHAR(127) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied = {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        # Каждая миграция - отдельная транзакция вместе с отметкой о ее применении
+        with engine.begin() as connection:
+            if _lock(connection):
+                already_applied = connection.execute(
+                    text("SELECT 1 FROM schema_migrations WHERE version = :version"), {"version": version}
+                ).first()
+                if already_applied:
+                    continue
+            migrate(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": name, "applied_at": datetime.utcnow()}
+            )
+        print(f"Applied migration {version}: {name}")
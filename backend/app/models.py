@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Enum, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Enum, DateTime, Text, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -21,7 +21,7 @@ class User(Base):
     max_points = Column(Integer, default=100)
     gold = Column(Integer, default=0)
     attack = Column(Integer, default=1)
-    team_id = Column(Integer, ForeignKey("teams.team_id"), nullable=True)
+    team_id = Column(Integer, ForeignKey("teams.team_id"), nullable=True, index=True)
     img = Column(String(255))
 
     # Relationships
@@ -59,6 +59,11 @@ class UserItem(Base):
     user = relationship("User", back_populates="items")
     item = relationship("Item", back_populates="user_items")
 
+    # Подсчет активных предметов пользователя (не больше 3 слотов)
+    __table_args__ = (
+        Index("ix_user_items_user_id_active", "user_id", "active"),
+    )
+
 class Class(Base):
     __tablename__ = "classes"
 
@@ -74,11 +79,15 @@ class Team(Base):
     __tablename__ = "teams"
 
     team_id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(63), nullable=False)
+    name = Column(String(63), nullable=False, index=True)
     owner_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     information = Column(String(255), nullable=True)
     boss_id = Column(Integer, ForeignKey("bosses.boss_id"), nullable=True)
     boss_lives = Column(Integer, default=0)
+    boss_kills = Column(Integer, default=0, server_default="0", nullable=False)
+    # Счетчики участников, обновляются вместе со сменой состава и уровней (crud.adjust_team_stats)
+    members_count = Column(Integer, default=0, server_default="0", nullable=False)
+    level_sum = Column(Integer, default=0, server_default="0", nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
@@ -105,18 +114,18 @@ class Catalog(Base):
     __tablename__ = "catalogs"
 
     catalog_id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
     name = Column(String(63), nullable=False)
 
     # Relationships
     user = relationship("User", back_populates="catalogs")
-    tasks = relationship("Task", back_populates="catalog", cascade="all, delete-orphan")
+    tasks = relationship("Task", back_populates="catalog", cascade="all, delete-orphan", order_by="Task.task_id")
 
 class Task(Base):
     __tablename__ = "tasks"
 
     task_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    catalog_id = Column(Integer, ForeignKey("catalogs.catalog_id"), nullable=False)
+    catalog_id = Column(Integer, ForeignKey("catalogs.catalog_id"), nullable=False, index=True)
     name = Column(String(127), nullable=False)
     complexity = Column(Enum('easy', 'normal', 'hard', name='task_complexity'), nullable=False)
     deadline = Column(Date, nullable=True)
@@ -124,13 +133,13 @@ class Task(Base):
     
     # Relationships
     catalog = relationship("Catalog", back_populates="tasks")
-    daily_tasks = relationship("DailyTask", back_populates="task")
+    daily_tasks = relationship("DailyTask", back_populates="task", order_by="DailyTask.daily_task_id")
 
 class DailyTask(Base):
     __tablename__ = "daily_task"
 
     daily_task_id = Column(Integer, primary_key=True, index=True)
-    task_id = Column(Integer, ForeignKey("tasks.task_id"), nullable=False)
+    task_id = Column(Integer, ForeignKey("tasks.task_id"), nullable=False, index=True)
     day_week = Column(Enum('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun', name='day_of_week'), nullable=False)
 
     # Relationships
@@ -146,6 +155,60 @@ class ChatMessage(Base):
     message = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    # История чата листается по (team_id, timestamp); message_id - для однозначного порядка
+    __table_args__ = (
+        Index("ix_chat_messages_team_id_timestamp", "team_id", "timestamp", "message_id"),
+    )
+
     # Relationships
     team = relationship("Team", back_populates="chat_messages")
-    user = relationship("User", back_populates="chat_messages")
\ No newline at end of file
+    user = relationship("User", back_populates="chat_messages")
+
+# Архив старых сообщений чата: сжатые блоки подряд идущих сообщений одной команды
+class ChatArchiveBlock(Base):
+    __tablename__ = "chat_archive_blocks"
+
+    block_id = Column(Integer, primary_key=True, index=True)
+    team_id = Column(Integer, ForeignKey("teams.team_id"), nullable=False)
+    first_message_id = Column(Integer, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    # Диапазон id в блоке: id выдаются при пакетной записи, поэтому их порядок
+    # может не совпадать с порядком (timestamp, message_id), по которому режутся блоки
+    min_message_id = Column(Integer, nullable=True)
+    max_message_id = Column(Integer, nullable=True)
+    data = Column(LargeBinary, nullable=False)  # zlib(JSON-список сообщений)
+
+    __table_args__ = (
+        Index("ix_chat_archive_blocks_team_id_last", "team_id", "last_timestamp", "last_message_id"),
+    )
+
+# Ежедневный сброс повторяющихся задач: одна запись на день с курсором прогресса
+class TaskResetRun(Base):
+    __tablename__ = "task_reset_runs"
+
+    run_date = Column(Date, primary_key=True)
+    day_week = Column(String(3), nullable=False)
+    status = Column(Enum('running', 'done', name='task_reset_status'), default='running', nullable=False)
+    last_task_id = Column(Integer, default=0, nullable=False)  # задачи до этого id уже сброшены
+    reset_count = Column(Integer, default=0, nullable=False)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+# Покупки предметов по ключу идемпотентности: повтор запроса возвращает результат первой покупки
+class ItemPurchase(Base):
+    __tablename__ = "item_purchases"
+
+    purchase_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("items.item_id"), nullable=False)
+    idempotency_key = Column(String(64), nullable=False)
+    price = Column(Integer, nullable=False)
+    user_gold = Column(Integer, nullable=False)  # баланс после покупки
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_key", name="uq_item_purchases_user_id_key"),
+    )
@@ -0,0 +1,155 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Максимальное количество пользователей, чьи модификаторы держим в памяти
+MODIFIERS_CACHE_SIZE = 10000
+# Кэш сбрасывается только в воркере, который изменил инвентарь или класс; остальные
+# воркеры увидят изменение (например, купленный предмет 15) не позже чем через TTL
+MODIFIERS_CACHE_TTL_SECONDS = float(os.getenv("MODIFIERS_CACHE_TTL_SECONDS", "5"))
+
+
+@dataclass(frozen=True)
+class EffectiveModifiers:
+    """Итоговые бонусы пользователя от класса и предметов в инвентаре"""
+    class_id: int = None
+    exp_class_multiplier: float = 1.0
+    gold_class_multiplier: float = 1.0
+    exp_bonus: float = 0.0            # предмет 5
+    exp_bonus_late: float = 0.0       # предмет 14 (начисляется после удвоения)
+    gold_bonus: float = 0.0           # предмет 7
+    double_exp_chance: float = 0.0    # предмет 9
+    double_gold_chance: float = 0.0   # предмет 12
+    dodge_chance: float = 0.0         # предмет 10
+    lives_protection: int = 0         # предмет 13
+    boss_gold_multiplier: int = 1     # предмет 15
+
+    def apply_rewards(self, gold_change: int, points_change: int):
+        """Посчитать награду (золото, опыт) с учетом всех бонусов"""
+        experience_reward = points_change
+        gold_reward = gold_change
+
+        # Классовые мультипликаторы
+        if self.exp_class_multiplier != 1.0:
+            experience_reward = int(experience_reward * self.exp_class_multiplier)
+        if self.gold_class_multiplier != 1.0:
+            gold_reward = int(gold_reward * self.gold_class_multiplier)
+
+        # Мультипликаторы вещей
+        if self.exp_bonus:
+            experience_reward += int(points_change * self.exp_bonus)
+        if self.gold_bonus:
+            gold_reward += int(gold_change * self.gold_bonus)
+        if self.double_exp_chance:
+            if random.random() < self.double_exp_chance:
+                experience_reward *= 2
+        if self.double_gold_chance:
+            if random.random() < self.double_gold_chance:
+                gold_reward *= 2
+        if self.exp_bonus_late:
+            experience_reward += int(points_change * self.exp_bonus_late)
+
+        return gold_reward, experience_reward
+
+    def dodges(self) -> bool:
+        """Срабатывает ли защита от потери жизни"""
+        return bool(self.dodge_chance) and random.random() < self.dodge_chance
+
+
+def build_modifiers(class_id, item_ids) -> EffectiveModifiers:
+    """Собрать модификаторы по классу и набору id предметов"""
+    item_ids = set(item_ids)
+    return EffectiveModifiers(
+        class_id=class_id,
+        exp_class_multiplier=1.1 if class_id == 2 else 1.0,
+        gold_class_multiplier=1.1 if class_id == 3 else 1.0,
+        exp_bonus=0.05 if 5 in item_ids else 0.0,
+        exp_bonus_late=0.1 if 14 in item_ids else 0.0,
+        gold_bonus=0.05 if 7 in item_ids else 0.0,
+        double_exp_chance=0.2 if 9 in item_ids else 0.0,
+        double_gold_chance=0.2 if 12 in item_ids else 0.0,
+        dodge_chance=0.2 if 10 in item_ids else 0.0,
+        lives_protection=1 if 13 in item_ids else 0,
+        boss_gold_multiplier=2 if 15 in item_ids else 1,
+    )
+
+
+_cache: "OrderedDict[int, tuple]" = OrderedDict()  # user_id -> (expires_at, EffectiveModifiers)
+_generation = 0
+_lock = threading.Lock()
+
+
+def get_user_modifiers(db: Session, db_user: models.User) -> EffectiveModifiers:
+    """Получить модификаторы пользователя (из кэша или пересчитать по инвентарю)"""
+    return get_users_modifiers(db, [db_user])[db_user.user_id]
+
+
+def get_users_modifiers(db: Session, users) -> Dict[int, EffectiveModifiers]:
+    """Получить модификаторы сразу для нескольких пользователей одним запросом к инвентарю
+
+    users - строки или объекты с полями user_id и class_id.
+    """
+    result = {}
+    missing = {}
+    now = time.monotonic()
+    with _lock:
+        for user in users:
+            expires_at, cached = _cache.get(user.user_id, (0, None))
+            if cached is not None and expires_at > now and cached.class_id == user.class_id:
+                _cache.move_to_end(user.user_id)
+                result[user.user_id] = cached
+            else:
+                missing[user.user_id] = user.class_id
+        generation = _generation
+
+    if not missing:
+        return result
+
+    item_ids = {user_id: [] for user_id in missing}
+    rows = db.query(models.UserItem.user_id, models.UserItem.item_id).filter(
+        models.UserItem.user_id.in_(list(missing))
+    ).all()
+    for row in rows:
+        item_ids[row.user_id].append(row.item_id)
+
+    computed = {
+        user_id: build_modifiers(class_id, item_ids[user_id])
+        for user_id, class_id in missing.items()
+    }
+    result.update(computed)
+
+    with _lock:
+        # Если инвентарь поменялся, пока мы считали, не кладем устаревшее значение
+        if _generation == generation:
+            # Срок считаем от момента чтения инвентаря
+            expires_at = now + MODIFIERS_CACHE_TTL_SECONDS
+            for user_id, user_modifiers in computed.items():
+                _cache[user_id] = (expires_at, user_modifiers)
+                _cache.move_to_end(user_id)
+            while len(_cache) > MODIFIERS_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return result
+
+
+def invalidate_user_modifiers(user_id: int):
+    """Сбросить кэш модификаторов пользователя после изменения инвентаря"""
+    global _generation
+    with _lock:
+        _cache.pop(user_id, None)
+        _generation += 1
+
+
+def clear_modifiers_cache():
+    """Полностью очистить кэш модификаторов"""
+    global _generation
+    with _lock:
+        _cache.clear()
+        _generation += 1
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session, joinedload
+
+from . import models, schemas
+
+# Снимки справочных таблиц (предметы, классы, боссы), уже сериализованные в JSON.
+# Каждый процесс держит свою копию; create_* сбрасывает ее сразу,
+# а изменения из других воркеров подхватываются не позже чем через TTL.
+REFERENCE_SNAPSHOT_TTL_SECONDS = float(os.getenv("REFERENCE_SNAPSHOT_TTL_SECONDS", "300"))
+# Ширина диапазона среднего уровня команды на один уровень босса: 1-10 - босс 1-го уровня, 11-20 - 2-го и т.д.
+BOSS_TIER_LEVEL_STEP = 10
+
+
+def _dumps(data) -> bytes:
+    # Тот же формат, что и у JSONResponse в FastAPI
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class Snapshot:
+    """Неизменяемый снимок таблицы: записи, готовое тело ответа и версия"""
+
+    def __init__(self, records):
+        self.records = records
+        self.body = _dumps(records)
+        self.version = hashlib.sha1(self.body).hexdigest()[:16]
+        self.created_at = time.monotonic()
+
+    def etag(self, skip: int = 0, limit: int = None) -> str:
+        if skip == 0 and (limit is None or limit >= len(self.records)):
+            return f'"{self.version}"'
+        return f'"{self.version}-{skip}-{limit}"'
+
+    def page(self, skip: int = 0, limit: int = None) -> bytes:
+        """Тело ответа для skip/limit (полный список отдается без повторной сериализации)"""
+        if skip == 0 and (limit is None or limit >= len(self.records)):
+            return self.body
+        end = None if limit is None else skip + limit
+        return _dumps(self.records[skip:end])
+
+
+class ReferenceCache:
+    """Ленивая загрузка снимка с TTL и сбросом после изменений"""
+
+    def __init__(self, name, loader, schema):
+        self.name = name
+        self._loader = loader
+        self._schema = schema
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> Snapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot.created_at < REFERENCE_SNAPSHOT_TTL_SECONDS:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - snapshot.created_at >= REFERENCE_SNAPSHOT_TTL_SECONDS:
+                snapshot = self._build(self._loader(db))
+                self._snapshot = snapshot
+        return snapshot
+
+    def _build(self, rows):
+        return Snapshot([jsonable_encoder(self._schema.from_orm(row)) for row in rows])
+
+    def invalidate(self):
+        """Сбросить снимок, следующий запрос перечитает таблицу"""
+        with self._lock:
+            self._snapshot = None
+
+
+def _load_items(db: Session):
+    return db.query(models.Item).options(
+        joinedload(models.Item.class_info)
+    ).order_by(models.Item.item_id).all()
+
+
+def _load_classes(db: Session):
+    return db.query(models.Class).order_by(models.Class.class_id).all()
+
+
+def _load_bosses(db: Session):
+    return db.query(models.Boss).order_by(models.Boss.boss_id).all()
+
+
+class BossTier(NamedTuple):
+    boss_id: int
+    name: str
+    level: int
+    base_lives: int
+    gold_reward: int
+
+
+class BossTiers:
+    """Неизменяемая таблица боссов: босс по id и по среднему уровню команды (bisect)"""
+
+    def __init__(self, bosses):
+        by_id = {}
+        by_level = {}
+        for boss in sorted(bosses, key=lambda boss: boss.boss_id):
+            tier = BossTier(boss.boss_id, boss.name, boss.level or 1, boss.base_lives, boss.gold_reward or 0)
+            by_id[tier.boss_id] = tier
+            # На уровень - босс с наименьшим id
+            by_level.setdefault(tier.level, tier)
+        self.tiers = tuple(by_level[level] for level in sorted(by_level))
+        # Верхняя граница среднего уровня команды для каждого босса (последний - без границы)
+        self._bounds = tuple(tier.level * BOSS_TIER_LEVEL_STEP for tier in self.tiers)
+        self._by_id = MappingProxyType(by_id)
+        self.created_at = time.monotonic()
+
+    def get(self, boss_id: int) -> Optional[BossTier]:
+        return self._by_id.get(boss_id)
+
+    def for_level(self, avg_level: int) -> Optional[BossTier]:
+        if not self.tiers:
+            return None
+        index = bisect_left(self._bounds, avg_level)
+        return self.tiers[min(index, len(self.tiers) - 1)]
+
+
+class BossTiersCache(ReferenceCache):
+    """Таблица боссов для выбора босса и расчета урона без запросов к БД"""
+
+    def _build(self, rows):
+        return BossTiers(rows)
+
+
+items_cache = ReferenceCache("items", _load_items, schemas.Item)
+classes_cache = ReferenceCache("classes", _load_classes, schemas.Class)
+bosses_cache = ReferenceCache("bosses", _load_bosses, schemas.Boss)
+boss_tiers = BossTiersCache("boss_tiers", _load_bosses, schemas.Boss)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Проверить заголовок If-None-Match (список значений, слабые ETag и *)"""
+    if not if_none_match:
+        return False
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*" or value.removeprefix("W/") == etag:
+            return True
+    return False
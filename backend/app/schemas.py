@@ -22,7 +22,7 @@ class Class(ClassBase):
     class_id: int
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 # --- User Schemas ---
 class UserBase(BaseModel):
@@ -64,7 +64,7 @@ class User(UserBase):
     img: Optional[str] = None
     
     class Config:
-        orm_mode = True
+        from_attributes = True
         
 # Упрощенная схема пользователя для команд
 class UserSimple(BaseModel):
@@ -95,7 +95,7 @@ class Item(ItemBase):
     class_info: Optional[Class] = None
 
     class Config:
-        orm_mode = True
+        from_attributes = True
         
 class BuyItemRequest(BaseModel):
     item_id: int
@@ -120,7 +120,7 @@ class UserItem(UserItemBase):
     user: Optional[User] = None
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 class UserItemUpdate(BaseModel):
     active: Optional[Literal['true', 'false']] = None
@@ -228,6 +228,32 @@ class BossAttackResult(BaseModel):
     boss_defeated: bool
     rewards_granted: Optional[Dict[str, Any]] = None
 
+# --- Leaderboard Schemas ---
+class LeaderboardUserEntry(BaseModel):
+    rank: int
+    user_id: int
+    nickname: str
+    level: int
+    points: int
+    img: Optional[str] = None
+    team_id: Optional[int] = None
+
+class LeaderboardTeamEntry(BaseModel):
+    rank: int
+    team_id: int
+    name: str
+    boss_kills: int
+    total_level: int
+    members_count: int
+
+class UserLeaderboard(BaseModel):
+    total: int
+    entries: List[LeaderboardUserEntry]
+
+class TeamLeaderboard(BaseModel):
+    total: int
+    entries: List[LeaderboardTeamEntry]
+
 
 # --- Catalog Schemas ---
 class CatalogBase(BaseModel):
@@ -242,7 +268,7 @@ class Catalog(CatalogBase):
     tasks: List['Task'] = []
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 # --- Task Schemas ---
 class TaskBase(BaseModel):
@@ -265,7 +291,7 @@ class DailyTaskSimple(DailyTaskBase):
     daily_task_id: int
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 # Полная схема Task с упрощенными DailyTask
 class Task(TaskBase):
@@ -273,10 +299,14 @@ class Task(TaskBase):
     daily_tasks: List[DailyTaskSimple] = []
 
     class Config:
-        orm_mode = True
+        from_attributes = True
         
 class TaskCreate(TaskBase):
     repeat_days: Optional[List[Literal['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']]] = None
+
+# Создание нескольких задач (например, импорт недельного плана) одним запросом
+class TaskBulkCreate(BaseModel):
+    tasks: List[TaskCreate] = Field(..., min_length=1, max_length=500)
     
 class TaskUpdate(BaseModel):
     name: Optional[str] = Field(None, max_length=127)
@@ -290,7 +320,7 @@ class TaskSimple(TaskBase):
     task_id: int
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 # Полная схема DailyTask с упрощенной Task
 class DailyTask(DailyTaskBase):
@@ -298,4 +328,4 @@ class DailyTask(DailyTaskBase):
     task: Optional[TaskSimple] = None
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        from_attributes = True
\ No newline at end of file
@@ -1,8 +1,11 @@
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Union, Any
+from typing import Union, Any, Optional, Tuple
 from jose import jwt
+import asyncio
 import os
+import threading
 
 # Configuration for JWT
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # 30 minutes
@@ -11,7 +14,12 @@ ALGORITHM = "HS256"
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key") # Should be kept secret
 JWT_REFRESH_SECRET_KEY = os.getenv("JWT_REFRESH_SECRET_KEY", "your-refresh-secret-key") # Should be kept secret
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Configuration for password hashing
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -19,6 +27,51 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+# bcrypt отпускает GIL, поэтому хватает отдельного пула потоков:
+# хеширование не блокирует event loop и не занимает общий threadpool FastAPI
+class PasswordHashingBusy(Exception):
+    """Очередь на хеширование паролей переполнена"""
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_lock = threading.Lock()
+_hash_stats = {"pending": 0, "max_pending_seen": 0, "completed": 0, "rejected": 0}
+
+async def _run_hashing(func, *args):
+    with _hash_lock:
+        if _hash_stats["pending"] >= PASSWORD_HASH_MAX_PENDING:
+            _hash_stats["rejected"] += 1
+            raise PasswordHashingBusy()
+        _hash_stats["pending"] += 1
+        _hash_stats["max_pending_seen"] = max(_hash_stats["max_pending_seen"], _hash_stats["pending"])
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        with _hash_lock:
+            _hash_stats["pending"] -= 1
+            _hash_stats["completed"] += 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Проверить пароль в пуле хеширования.
+
+    Возвращает (верен ли пароль, новый хеш или None), новый хеш появляется,
+    если pwd_context считает старый устаревшим (например, сменился BCRYPT_ROUNDS).
+    """
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Захешировать пароль в пуле хеширования"""
+    return await _run_hashing(pwd_context.hash, password)
+
+def get_password_hashing_stats() -> dict:
+    """Метрики пула хеширования паролей"""
+    with _hash_lock:
+        return {
+            **_hash_stats,
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_pending": PASSWORD_HASH_MAX_PENDING,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+        }
+
 def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
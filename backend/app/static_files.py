@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from email.utils import formatdate
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость
+    brotli = None
+
+# Индекс файлов фронтенда: строится один раз при старте вместо os.path.* на каждый запрос
+STATIC_ASSET_MAX_AGE = int(os.getenv("STATIC_ASSET_MAX_AGE", str(7 * 24 * 3600)))
+# Файлы больше этого размера не держим в памяти, а отдаем с диска
+STATIC_MEMORY_LIMIT = int(os.getenv("STATIC_MEMORY_LIMIT", str(1024 * 1024)))
+# Сжимать меньшие файлы нет смысла
+STATIC_COMPRESS_MIN_SIZE = 512
+
+MEDIA_TYPES = {
+    ".html": "text/html",
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml",
+    ".json": "application/json",
+}
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "application/javascript", "image/svg+xml", "application/json"}
+# Для этих файлов допускаем долгое кэширование в браузере, HTML всегда перепроверяется
+LONG_CACHE_EXTENSIONS = {".css", ".js", ".png", ".jpg", ".jpeg", ".svg", ".gif", ".webp", ".ico", ".woff", ".woff2"}
+
+
+def get_media_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in MEDIA_TYPES:
+        return MEDIA_TYPES[ext]
+    return mimetypes.guess_type(path)[0] or "text/html"
+
+
+class StaticAsset:
+    """Файл фронтенда с заранее посчитанными заголовками и сжатыми вариантами"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        stat = os.stat(file_path)
+        self.size = stat.st_size
+        self.media_type = get_media_type(file_path)
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext in LONG_CACHE_EXTENSIONS:
+            self.cache_control = f"public, max-age={STATIC_ASSET_MAX_AGE}"
+        else:
+            self.cache_control = "no-cache"
+
+        self.content = None
+        self.variants = {}  # encoding -> сжатое содержимое
+        if self.size <= STATIC_MEMORY_LIMIT:
+            with open(file_path, "rb") as f:
+                self.content = f.read()
+            self.etag = '"' + hashlib.sha1(self.content).hexdigest()[:20] + '"'
+            if self.media_type in COMPRESSIBLE_TYPES and self.size >= STATIC_COMPRESS_MIN_SIZE:
+                self._load_variants()
+        else:
+            self.etag = f'"{int(stat.st_mtime)}-{self.size}"'
+
+    def _load_variants(self):
+        # Готовые file.br / file.gz рядом с файлом имеют приоритет над сжатием при старте
+        for encoding, suffix, compress in (
+            ("br", ".br", brotli.compress if brotli else None),
+            ("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+        ):
+            precompressed_path = self.file_path + suffix
+            if os.path.isfile(precompressed_path):
+                with open(precompressed_path, "rb") as f:
+                    data = f.read()
+            elif compress is not None:
+                data = compress(self.content)
+            else:
+                continue
+            if len(data) < self.size:
+                self.variants[encoding] = data
+
+    def headers(self, encoding: str = None) -> dict:
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": self.last_modified,
+            "Cache-Control": self.cache_control,
+        }
+        if self.variants:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return headers
+
+    def choose_encoding(self, accept_encoding: str):
+        """Выбрать сжатый вариант по Accept-Encoding (br предпочтительнее gzip)"""
+        if not self.variants or not accept_encoding:
+            return None
+        accepted = set()
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return None
+
+    def not_modified(self, if_none_match: str, if_modified_since: str) -> bool:
+        if if_none_match:
+            return any(
+                value.strip() == "*" or value.strip().removeprefix("W/") == self.etag
+                for value in if_none_match.split(",")
+            )
+        return if_modified_since == self.last_modified
+
+
+class StaticIndex:
+    """Отображение URL-путей фронтенда на файлы"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.assets = {}
+        self.directories = set()
+
+    def build(self):
+        assets = {}
+        directories = set()
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                directories.add(os.path.relpath(dirpath, self.root).replace(os.sep, "/"))
+                for filename in filenames:
+                    if filename.endswith((".gz", ".br")):
+                        continue
+                    file_path = os.path.join(dirpath, filename)
+                    rel_path = os.path.relpath(file_path, self.root).replace(os.sep, "/")
+                    assets[rel_path] = StaticAsset(file_path)
+            # Каталоги отдают свой index.html
+            for rel_path in list(assets):
+                if rel_path == "index.html" or rel_path.endswith("/index.html"):
+                    dir_path = rel_path[:-len("index.html")]
+                    assets[dir_path] = assets[rel_path]
+                    assets[dir_path.rstrip("/")] = assets[rel_path]
+        self.assets = assets
+        self.directories = directories
+        return self
+
+    def lookup(self, path: str):
+        return self.assets.get(path.lstrip("/"))
+
+    def is_directory(self, path: str) -> bool:
+        """Есть ли такой каталог во фронтенде"""
+        return (path.strip("/") or ".") in self.directories
@@ -0,0 +1,266 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import crud, models, modifiers, user_cache, leaderboard
+from .database import SessionLocal
+
+# Сброс повторяющихся задач: в начале дня недели все задачи, у которых в daily_task
+# есть этот день, снова становятся невыполненными. Сброс идет порциями по
+# TASK_RESET_CHUNK_SIZE задач; курсор хранится в task_reset_runs и сохраняется в той
+# же транзакции, что и порция, поэтому после падения работа продолжается с места остановки.
+TASK_RESET_TIMEZONE = os.getenv("TASK_RESET_TIMEZONE", "UTC")
+TASK_RESET_CHUNK_SIZE = int(os.getenv("TASK_RESET_CHUNK_SIZE", "5000"))
+# Как часто проверять, что сброс за сегодня выполнен (и продолжать прерванный)
+TASK_RESET_CHECK_INTERVAL_SECONDS = int(os.getenv("TASK_RESET_CHECK_INTERVAL_SECONDS", "300"))
+
+# Штраф за просроченные задачи: пользователи обрабатываются порциями по OVERDUE_SWEEP_CHUNK_SIZE
+OVERDUE_SWEEP_CHUNK_SIZE = int(os.getenv("OVERDUE_SWEEP_CHUNK_SIZE", "1000"))
+# Часовой пояс пользователя не хранится, поэтому задача считается просроченной, когда
+# день дедлайна закончился во всех поясах: по умолчанию граница дня берется по UTC-12
+# (Etc/GMT+12), и западные пользователи не теряют задачи, которые у них еще "сегодня".
+# Восточным поясам штраф приходит позже (UTC+14 - через 26 часов после конца дня).
+OVERDUE_SWEEP_TIMEZONE = os.getenv("OVERDUE_SWEEP_TIMEZONE", "Etc/GMT+12")
+# Потеря жизней за просроченную задачу по сложности
+OVERDUE_DAMAGE = {'easy': 3, 'normal': 4, 'hard': 5}
+
+DAYS_OF_WEEK = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def today() -> date:
+    return datetime.now(ZoneInfo(TASK_RESET_TIMEZONE)).date()
+
+
+def overdue_cutoff() -> date:
+    """Первый день, который еще не закончился хотя бы в одном часовом поясе"""
+    return datetime.now(ZoneInfo(OVERDUE_SWEEP_TIMEZONE)).date()
+
+
+def seconds_until_next_day() -> float:
+    now = datetime.now(ZoneInfo(TASK_RESET_TIMEZONE))
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+    return (midnight - now).total_seconds()
+
+
+def get_or_create_run(db: Session, run_date: date, status: str = 'running') -> models.TaskResetRun:
+    run = db.get(models.TaskResetRun, run_date)
+    if run is not None:
+        return run
+    run = models.TaskResetRun(run_date=run_date, day_week=DAYS_OF_WEEK[run_date.weekday()], status=status)
+    db.add(run)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Запись уже создал другой воркер
+        db.rollback()
+        run = db.get(models.TaskResetRun, run_date)
+    return run
+
+
+def reset_chunk(db: Session, run_date: date) -> bool:
+    """Сбросить следующую порцию задач; False, когда сбрасывать больше нечего"""
+    run = db.query(models.TaskResetRun).filter(
+        models.TaskResetRun.run_date == run_date
+    ).with_for_update().populate_existing().first()
+    if run is None or run.status == 'done':
+        db.rollback()
+        return False
+
+    # Граница порции: TASK_RESET_CHUNK_SIZE следующих задач с этим днем повтора
+    scheduled = db.query(models.DailyTask.task_id).filter(
+        models.DailyTask.day_week == run.day_week
+    )
+    chunk = scheduled.filter(
+        models.DailyTask.task_id > run.last_task_id
+    ).distinct().order_by(models.DailyTask.task_id).limit(TASK_RESET_CHUNK_SIZE).subquery()
+    chunk_end = db.query(func.max(chunk.c.task_id)).scalar()
+
+    if chunk_end is None:
+        run.status = 'done'
+        run.finished_at = datetime.utcnow()
+        db.commit()
+        return False
+
+    reset = db.query(models.Task).filter(
+        models.Task.task_id > run.last_task_id,
+        models.Task.task_id <= chunk_end,
+        models.Task.completed == 'true',
+        models.Task.task_id.in_(scheduled.scalar_subquery()),
+    ).update({"completed": 'false'}, synchronize_session=False)
+
+    run.last_task_id = chunk_end
+    run.reset_count += reset
+    db.commit()
+    return True
+
+
+def reset_recurring_tasks(db: Session, run_date: date) -> models.TaskResetRun:
+    """Выполнить (или продолжить) сброс задач за run_date"""
+    get_or_create_run(db, run_date)
+    while reset_chunk(db, run_date):
+        pass
+    return db.get(models.TaskResetRun, run_date)
+
+
+def apply_life_loss(user: models.User, damage: int, user_modifiers: modifiers.EffectiveModifiers):
+    """Одна потеря жизней по правилам crud.decrease_user_lives: уклонение (предмет 10),
+    защита (предмет 13), при гибели - полные жизни и потеря уровня"""
+    if user_modifiers.dodges():
+        return False
+    lives = user.lives - damage + user_modifiers.lives_protection
+    if lives <= 0:
+        lives = user.max_lives
+        user.level = user.level - 1 if user.level > 1 else 1
+        user.max_points = 100 * user.level
+        user.attack = user.attack - 1 if user.attack > 1 else user.attack
+        user.points = 0
+    user.lives = lives
+    return True
+
+
+def sweep_overdue_chunk(db: Session, run_date: date, after_user_id: int):
+    """Оштрафовать порцию пользователей за просроченные невыполненные задачи.
+
+    Возвращает (последний user_id порции или None, {"users", "tasks", "hits"}).
+    Просроченные задачи удаляются (как и на странице задач); DELETE ... RETURNING
+    одновременно "забирает" их, поэтому параллельный запуск не оштрафует дважды.
+    """
+    Task = models.Task
+    overdue = (Task.deadline < run_date, Task.completed == 'false')
+    user_ids = [row[0] for row in db.query(models.Catalog.user_id).join(
+        Task, Task.catalog_id == models.Catalog.catalog_id
+    ).filter(
+        *overdue, models.Catalog.user_id > after_user_id
+    ).distinct().order_by(models.Catalog.user_id).limit(OVERDUE_SWEEP_CHUNK_SIZE)]
+    if not user_ids:
+        db.rollback()
+        return None, None
+
+    catalogs = db.query(models.Catalog.catalog_id).filter(models.Catalog.user_id.in_(user_ids))
+    overdue_tasks = db.query(Task.task_id).filter(*overdue, Task.catalog_id.in_(catalogs.scalar_subquery()))
+    db.execute(delete(models.DailyTask).where(models.DailyTask.task_id.in_(overdue_tasks.scalar_subquery())))
+    claimed = db.execute(
+        delete(Task).where(*overdue, Task.catalog_id.in_(catalogs.scalar_subquery())).returning(
+            Task.catalog_id, Task.complexity, Task.deadline, Task.task_id
+        ),
+        execution_options={"synchronize_session": False},
+    ).all()
+    owners = dict(db.query(models.Catalog.catalog_id, models.Catalog.user_id).filter(
+        models.Catalog.user_id.in_(user_ids)
+    ).all())
+
+    users = db.query(models.User).filter(
+        models.User.user_id.in_(user_ids)
+    ).order_by(models.User.user_id).with_for_update().populate_existing().all()
+    users_by_id = {user.user_id: user for user in users}
+    users_modifiers = modifiers.get_users_modifiers(db, users)
+
+    result = {"users": len({owners.get(row[0]) for row in claimed}), "tasks": len(claimed), "hits": 0}
+    levels_before = {user.user_id: user.level for user in users}
+    for catalog_id, complexity, deadline, task_id in sorted(claimed, key=lambda row: (row[2], row[3])):
+        user = users_by_id.get(owners.get(catalog_id))
+        if user is None:
+            continue
+        damage = OVERDUE_DAMAGE[complexity]
+        if user.class_id == 4:
+            damage -= 1
+        if apply_life_loss(user, damage, users_modifiers[user.user_id]):
+            result["hits"] += 1
+
+    # Потерянные уровни - в счетчики команд, одним UPDATE на команду
+    team_level_deltas = {}
+    for user in users:
+        if user.team_id is not None and user.level != levels_before[user.user_id]:
+            team_level_deltas[user.team_id] = (
+                team_level_deltas.get(user.team_id, 0) + user.level - levels_before[user.user_id]
+            )
+    for team_id, level_delta in team_level_deltas.items():
+        crud.adjust_team_stats(db, team_id, level_delta=level_delta)
+
+    db.commit()
+    user_cache.invalidate_users(user_ids)
+    leaderboard.update_users(db, user_ids)
+    return user_ids[-1], result
+
+
+def sweep_overdue_tasks(db: Session, run_date: date) -> dict:
+    """Оштрафовать всех пользователей с задачами, срок которых истек до run_date"""
+    result = {"users": 0, "tasks": 0, "hits": 0}
+    after_user_id = 0
+    while True:
+        last_user_id, chunk_result = sweep_overdue_chunk(db, run_date, after_user_id)
+        if last_user_id is None:
+            return result
+        for key, value in chunk_result.items():
+            result[key] += value
+        after_user_id = last_user_id
+
+
+class TaskResetScheduler:
+    """Фоновый запуск сброса повторяющихся задач и штрафа за просроченные на границе дня"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._task = None
+        self.stats = {"runs": 0, "errors": 0, "last_run_date": None, "last_reset_count": 0, "last_overdue_sweep": None}
+        self._swept_date = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def run_due(self):
+        """Сброс за сегодня (или его продолжение после падения) и штраф за просроченные задачи"""
+        with self.session_factory() as db:
+            run_date = today()
+            if db.query(models.TaskResetRun).first() is None:
+                # Первый запуск: сегодняшние отметки не трогаем, сбрасываем со следующего дня
+                get_or_create_run(db, run_date, status='done')
+                return
+            # Прерванный сброс за прошлые дни не продолжаем: те задачи уже могли
+            # выполнить заново, а следующий их день повтора сбросит их сам
+            db.query(models.TaskResetRun).filter(
+                models.TaskResetRun.status == 'running', models.TaskResetRun.run_date < run_date
+            ).update({"status": 'done', "finished_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+
+            run = db.get(models.TaskResetRun, run_date)
+            if run is None or run.status != 'done':
+                run = reset_recurring_tasks(db, run_date)
+                self.stats["runs"] += 1
+                self.stats["last_run_date"] = run.run_date.isoformat()
+                self.stats["last_reset_count"] = run.reset_count
+
+            # Штраф за задачи, день дедлайна которых закончился во всех поясах, - раз в день
+            cutoff = overdue_cutoff()
+            if self._swept_date != cutoff:
+                result = sweep_overdue_tasks(db, cutoff)
+                self._swept_date = cutoff
+                self.stats["last_overdue_sweep"] = {"date": cutoff.isoformat(), **result}
+
+    async def _run(self):
+        while True:
+            try:
+                # Синхронная сессия - в отдельном потоке, чтобы не блокировать event loop
+                await asyncio.to_thread(self.run_due)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error resetting recurring tasks: {e}")
+            await asyncio.sleep(min(TASK_RESET_CHECK_INTERVAL_SECONDS, seconds_until_next_day() + 1))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "timezone": TASK_RESET_TIMEZONE, "overdue_timezone": OVERDUE_SWEEP_TIMEZONE}
@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+from . import database
+from .migrations import TEAM_STATS_BACKFILL_SQL
+
+# Пересчет счетчиков команд (teams.members_count, teams.level_sum) по таблице users.
+# Обычно счетчики поддерживает crud.adjust_team_stats; команда нужна для заполнения
+# старых данных или исправления расхождений: python -m app.team_stats
+
+
+def rebuild_team_stats():
+    """Пересчитать число участников и сумму уровней всех команд"""
+    db = database.SessionLocal()
+    try:
+        result = db.execute(text(TEAM_STATS_BACKFILL_SQL))
+        db.commit()
+        print(f"Счетчики пересчитаны для команд: {result.rowcount}")
+    except Exception as e:
+        print(f"Ошибка при пересчете счетчиков команд: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_team_stats()
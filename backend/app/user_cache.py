@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import schemas
+
+# Кэш авторизованных пользователей для get_current_user (ключ - login из токена).
+# Кэш свой у каждого воркера и сбрасывается только там, где было изменение, поэтому
+# снимок может отставать до USER_CACHE_TTL_SECONDS. Он нужен только для авторизации:
+# профиль, характеристики и команду эндпоинты читают из БД (crud.get_user_team_id).
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+_cache: "OrderedDict[str, tuple]" = OrderedDict()  # login -> (expires_at, schemas.User)
+_logins = {}  # user_id -> login, чтобы сбрасывать кэш по id пользователя
+_generation = 0
+_lock = threading.Lock()
+
+
+def get_cached_user(login: str):
+    """Получить копию снимка пользователя из кэша или None"""
+    with _lock:
+        entry = _cache.get(login)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at < time.monotonic():
+            _forget(login)
+            return None
+        _cache.move_to_end(login)
+    # Копия, чтобы изменения в обработчике не попали в общий кэш
+    return snapshot.model_copy(deep=True)
+
+
+def current_generation() -> int:
+    """Номер поколения кэша: запоминается до запроса в БД и передается в cache_user"""
+    with _lock:
+        return _generation
+
+
+def cache_user(login: str, db_user, generation: int):
+    """Положить снимок пользователя в кэш и вернуть его копию
+
+    Если с момента generation кэш сбрасывался, снимок мог устареть,
+    поэтому он возвращается, но не сохраняется.
+    """
+    snapshot = schemas.User.model_validate(db_user)
+    with _lock:
+        if generation == _generation:
+            _cache[login] = (time.monotonic() + USER_CACHE_TTL_SECONDS, snapshot)
+            _cache.move_to_end(login)
+            _logins[snapshot.user_id] = login
+            while len(_cache) > USER_CACHE_SIZE:
+                old_login, (_, old_snapshot) = _cache.popitem(last=False)
+                _logins.pop(old_snapshot.user_id, None)
+    return snapshot.model_copy(deep=True)
+
+
+def _forget(login: str):
+    entry = _cache.pop(login, None)
+    if entry is not None:
+        _logins.pop(entry[1].user_id, None)
+
+
+def invalidate_user(user_id: int):
+    """Сбросить кэш пользователя после изменения его профиля, характеристик или команды"""
+    invalidate_users([user_id])
+
+
+def invalidate_users(user_ids):
+    """Сбросить кэш нескольких пользователей"""
+    global _generation
+    with _lock:
+        _generation += 1
+        for user_id in user_ids:
+            login = _logins.get(user_id)
+            if login is not None:
+                _forget(login)
+
+
+def invalidate_team(team_id: int):
+    """Сбросить кэш всех закэшированных участников команды"""
+    global _generation
+    with _lock:
+        _generation += 1
+        for login, (_, snapshot) in list(_cache.items()):
+            if snapshot.team_id == team_id:
+                _forget(login)
+
+
+def clear_user_cache():
+    """Полностью очистить кэш пользователей"""
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
+        _logins.clear()
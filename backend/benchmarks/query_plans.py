@@ -0,0 +1,87 @@
+"""Проверка планов запросов crud.py, которые выполняются почти на каждый запрос API.
+
+Для каждой функции перехватывается реальный SQL, выполняется EXPLAIN и проверяется,
+что план использует ожидаемый индекс; затем замеряется среднее время вызова.
+Запуск из каталога backend (используется DATABASE_URL из окружения):
+
+    python -m benchmarks.query_plans [--runs 200]
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import event
+
+from app import crud, migrations, models
+from app.database import SessionLocal, engine
+
+# Функция crud -> (модель, из которой берется id для вызова, индекс, который должен быть в плане)
+CHECKS = [
+    ("get_catalog_tasks", models.Catalog.catalog_id, "ix_tasks_catalog_id"),
+    ("get_team_members", models.Team.team_id, "ix_users_team_id"),
+    ("get_active_items_count", models.User.user_id, "ix_user_items_user_id_active"),
+]
+
+
+def capture_statements(db, func, *args):
+    """Выполнить func и вернуть список (sql, параметры), отправленных в БД"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func(db, *args)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def explain(db, statement, parameters) -> str:
+    connection = db.connection()
+    if connection.dialect.name == "postgresql":
+        # На маленьких таблицах планировщик и так выберет seq scan; проверяем, что индекс применим
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = connection.exec_driver_sql("EXPLAIN " + statement, parameters).all()
+        return "\n".join(row[0] for row in rows)
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200, help="число вызовов для замера времени")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    migrations.run_migrations(engine)
+
+    failed = False
+    with SessionLocal() as db:
+        for func_name, id_column, index_name in CHECKS:
+            func = getattr(crud, func_name)
+            object_id = db.query(id_column).order_by(id_column).limit(1).scalar() or 1
+            db.rollback()
+
+            statements = capture_statements(db, func, object_id)
+            plans = [explain(db, statement, parameters) for statement, parameters in statements]
+            db.rollback()
+            uses_index = any(index_name in plan for plan in plans)
+
+            started = time.perf_counter()
+            for _ in range(args.runs):
+                func(db, object_id)
+                db.rollback()
+            elapsed_ms = (time.perf_counter() - started) * 1000 / args.runs
+
+            print(f"{func_name}: {'OK' if uses_index else 'NO INDEX'} ({index_name}), {elapsed_ms:.3f} ms/call")
+            if not uses_index:
+                failed = True
+                for plan in plans:
+                    print("    " + plan.replace("\n", "\n    "))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Тесты работают с отдельной SQLite-базой; переменная задается до импорта app
+_db_dir = tempfile.mkdtemp(prefix="gamify-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from app import database, init_bosses, init_classes, init_items, main
+
+_logins = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    init_classes.init_classes()
+    init_items.init_items()
+    init_bosses.init_bosses()
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def register(client):
+    """Зарегистрировать пользователя; возвращает (user_id, заголовки авторизации)"""
+    def _register(class_id=None):
+        login = f"user{next(_logins)}"
+        response = client.post("/api/auth/register", json={
+            "login": login, "nickname": login, "password": "12345678", "class_id": class_id
+        })
+        assert response.status_code == 201, response.text
+        token = client.post("/api/auth/token", data={"username": login, "password": "12345678"})
+        assert token.status_code == 200, token.text
+        return response.json()["user_id"], {"Authorization": f"Bearer {token.json()['access_token']}"}
+    return _register
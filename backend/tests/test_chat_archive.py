@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from app import chat_archive, models
+
+
+def test_archived_cursor_found_when_ids_not_in_timestamp_order(client, register, db):
+    owner_id, owner = register()
+    team_id = client.post("/api/teams", json={"name": "archive-order"}, headers=owner).json()["team_id"]
+
+    # id выдаются при пакетной записи: сообщение с меньшим id может прийти позже
+    start = datetime.utcnow() - timedelta(days=60)
+    offsets = [3, 0, 1, 2]
+    messages = [
+        models.ChatMessage(team_id=team_id, user_id=owner_id, message=f"m{offset}", timestamp=start + timedelta(minutes=offset))
+        for offset in offsets
+    ]
+    db.add_all(messages)
+    db.commit()
+    ids = {offset: message.message_id for offset, message in zip(offsets, messages)}
+    chat_archive.archive_old_messages(db, datetime.utcnow() - timedelta(days=30))
+    assert db.query(models.ChatMessage).filter(models.ChatMessage.team_id == team_id).count() == 0
+
+    before = client.get(f"/api/teams/{team_id}/chat", params={"before": ids[1]}, headers=owner)
+    after = client.get(f"/api/teams/{team_id}/chat", params={"after": ids[1]}, headers=owner)
+
+    assert before.status_code == 200, before.text
+    assert [m["message"] for m in before.json()] == ["m0"]
+    assert [m["message"] for m in after.json()] == ["m2", "m3"]
+
+
+def test_chat_limit_is_validated(client, register):
+    owner_id, owner = register()
+    team_id = client.post("/api/teams", json={"name": "chat-limit"}, headers=owner).json()["team_id"]
+
+    for limit in (0, -1, 201):
+        response = client.get(f"/api/teams/{team_id}/chat", params={"limit": limit}, headers=owner)
+        assert response.status_code == 422, (limit, response.text)
+    assert client.get(f"/api/teams/{team_id}/chat", params={"limit": 200}, headers=owner).status_code == 200
@@ -0,0 +1,111 @@
+import asyncio
+
+from sqlalchemy.exc import IntegrityError
+
+from app import chat_persistence
+from app.chat_persistence import ChatPersistencePipeline
+
+
+class FlakySession:
+    """Сессия, у которой запись падает, пока failures > 0, а строки bad_teams отвергаются"""
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, statement, rows):
+        if self.owner.failures > 0:
+            self.owner.failures -= 1
+            raise RuntimeError("database is down")
+        if any(row["team_id"] in self.owner.bad_teams for row in rows):
+            raise IntegrityError("INSERT INTO chat_messages", rows, Exception("FOREIGN KEY constraint failed"))
+        self.owner.batch_sizes.append(len(rows))
+        self.owner.written.extend(row["message"] for row in rows)
+
+    async def commit(self):
+        pass
+
+
+class FlakyFactory:
+    def __init__(self, failures, bad_teams=()):
+        self.failures = failures
+        self.bad_teams = set(bad_teams)
+        self.written = []
+        self.batch_sizes = []
+
+    def __call__(self):
+        return FlakySession(self)
+
+
+def test_failed_batch_is_retried(monkeypatch, tmp_path):
+    monkeypatch.setattr(chat_persistence, "CHAT_SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(chat_persistence, "CHAT_RETRY_INTERVAL_MS", 10)
+    factory = FlakyFactory(failures=chat_persistence.CHAT_FLUSH_RETRIES)
+
+    async def scenario():
+        pipeline = ChatPersistencePipeline(session_factory=factory)
+        await pipeline.start()
+        await pipeline.submit(1, 1, "first")
+        await asyncio.sleep(1)
+        await pipeline.submit(1, 1, "second")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+
+    assert factory.written == ["first", "second"]
+    assert pipeline.stats["spilled"] == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unsaved_messages_survive_restart(monkeypatch, tmp_path):
+    monkeypatch.setattr(chat_persistence, "CHAT_SPILL_DIR", str(tmp_path))
+    down = FlakyFactory(failures=10 ** 6)
+
+    async def run(factory, message=None):
+        pipeline = ChatPersistencePipeline(session_factory=factory)
+        await pipeline.start()
+        if message:
+            await pipeline.submit(1, 1, message)
+        await pipeline.stop()
+        return pipeline
+
+    first = asyncio.run(run(down, "lost?"))
+    assert first.stats["spilled"] == 1
+    assert len(list(tmp_path.glob("*.jsonl"))) == 1
+
+    up = FlakyFactory(failures=0)
+    second = asyncio.run(run(up))
+
+    assert up.written == ["lost?"]
+    assert second.stats["recovered"] == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rejected_row_does_not_block_batch(monkeypatch, tmp_path):
+    monkeypatch.setattr(chat_persistence, "CHAT_SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(chat_persistence, "CHAT_FLUSH_BATCH_SIZE", 4)
+    factory = FlakyFactory(failures=0, bad_teams={2})
+
+    async def scenario():
+        pipeline = ChatPersistencePipeline(session_factory=factory)
+        await pipeline.start()
+        for number in range(10):
+            await pipeline.submit(2 if number == 5 else 1, 1, f"m{number}")
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+
+    assert factory.written == [f"m{number}" for number in range(10) if number != 5]
+    assert max(factory.batch_sizes) <= 4
+    assert pipeline.stats["rejected"] == 1
+    assert pipeline.stats["spilled"] == 0
+    assert list(tmp_path.glob("*.jsonl")) == []
+    [rejected] = (tmp_path / "rejected").glob("*.jsonl")
+    assert '"m5"' in rejected.read_text(encoding="utf-8")
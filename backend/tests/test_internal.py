@@ -0,0 +1,16 @@
+from app import main
+
+
+def test_metrics_are_closed_without_token(client, monkeypatch):
+    monkeypatch.setattr(main, "INTERNAL_METRICS_TOKEN", None)
+    assert client.get("/api/internal/metrics").status_code == 404
+    assert client.get("/api/internal/metrics", headers={"X-Internal-Token": ""}).status_code == 404
+
+
+def test_metrics_require_matching_token(client, monkeypatch):
+    monkeypatch.setattr(main, "INTERNAL_METRICS_TOKEN", "secret")
+    assert client.get("/api/internal/metrics").status_code == 403
+    assert client.get("/api/internal/metrics", headers={"X-Internal-Token": "wrong"}).status_code == 403
+    response = client.get("/api/internal/metrics", headers={"X-Internal-Token": "secret"})
+    assert response.status_code == 200
+    assert "db_pool" in response.json()
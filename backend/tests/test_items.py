@@ -0,0 +1,48 @@
+from app import item_effects, models
+
+
+def _toggle(client, headers, item_id, active):
+    return client.put(f"/api/user-items/{item_id}/toggle-active", json={"active": active}, headers=headers)
+
+
+def test_item_added_by_another_worker_is_applied(client, register, db):
+    user_id, headers = register()
+    client.get("/api/users/me", headers=headers)
+    item_effects.effects.get(db)  # таблица эффектов уже собрана
+    # Предмет создан другим воркером: локальная таблица о нем не знает
+    item = models.Item(name="Новый клинок", price=10, type="rare", bonus_type="attack", bonus_data=7)
+    db.add(item)
+    db.commit()
+    db.add(models.UserItem(user_id=user_id, item_id=item.item_id, active="false"))
+    db.commit()
+
+    response = _toggle(client, headers, item.item_id, "true")
+
+    assert response.status_code == 200, response.text
+    assert response.json()["active"] == "true"
+    db.expire_all()
+    assert db.get(models.User, user_id).attack == 1 + 7
+
+
+def test_unknown_item_is_not_reported_as_consumed(client, register):
+    user_id, headers = register()
+
+    response = _toggle(client, headers, 10 ** 6, "true")
+
+    assert response.status_code == 404
+
+
+def test_activation_respects_slots_and_is_idempotent(client, register, db):
+    user_id, headers = register()
+    for item_id in (5, 7, 8, 9):
+        db.add(models.UserItem(user_id=user_id, item_id=item_id, active="false"))
+    db.commit()
+
+    assert _toggle(client, headers, 8, "true").status_code == 200
+    assert _toggle(client, headers, 8, "true").status_code == 200
+    assert _toggle(client, headers, 5, "true").status_code == 200
+    assert _toggle(client, headers, 7, "true").status_code == 200
+    assert _toggle(client, headers, 9, "true").status_code == 400
+
+    db.expire_all()
+    assert db.get(models.User, user_id).attack == 1 + 5
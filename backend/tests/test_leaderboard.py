@@ -0,0 +1,34 @@
+import sys
+import threading
+from types import SimpleNamespace
+
+from app import leaderboard
+
+
+def test_concurrent_updates_keep_team_totals():
+    team_id, first_user_id, threads_count, rounds = 10 ** 6, 10 ** 6, 8, 200
+    leaderboard.update_team(SimpleNamespace(team_id=team_id, name="race", boss_kills=0))
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def level_up(user_id):
+        for level in range(1, rounds + 1):
+            leaderboard.update_user(SimpleNamespace(
+                user_id=user_id, nickname="racer", level=level, points=0, img=None, team_id=team_id
+            ))
+
+    threads = [threading.Thread(target=level_up, args=(first_user_id + number,)) for number in range(threads_count)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+        entry = leaderboard.teams.get(team_id)
+        leaderboard.remove_team(team_id)
+        for number in range(threads_count):
+            leaderboard.users.remove(first_user_id + number)
+
+    assert entry["members_count"] == threads_count
+    assert entry["total_level"] == threads_count * rounds
@@ -0,0 +1,18 @@
+import time
+
+from app import models, modifiers
+
+
+def test_other_workers_purchase_is_seen_after_ttl(client, register, db, monkeypatch):
+    user_id, headers = register()
+    user = db.get(models.User, user_id)
+    assert modifiers.get_user_modifiers(db, user).boss_gold_multiplier == 1
+
+    # Покупка на другом воркере: инвентарь в БД изменился, локальный кэш не сброшен
+    db.add(models.UserItem(user_id=user_id, item_id=15))
+    db.commit()
+    assert modifiers.get_user_modifiers(db, user).boss_gold_multiplier == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + modifiers.MODIFIERS_CACHE_TTL_SECONDS + 1)
+    assert modifiers.get_user_modifiers(db, user).boss_gold_multiplier == 2
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+from app import models, task_scheduler
+
+
+def test_overdue_sweep_spares_tasks_due_today_anywhere(client, register, db):
+    user_id, headers = register()
+    catalog = client.post("/api/catalogs/", json={"user_id": 0, "name": "sweep"}, headers=headers).json()
+    cutoff = task_scheduler.overdue_cutoff()
+    due_today = client.post("/api/tasks/", json={
+        "catalog_id": catalog["catalog_id"], "name": "still today", "complexity": "hard",
+        "deadline": cutoff.isoformat(),
+    }, headers=headers).json()
+    overdue = client.post("/api/tasks/", json={
+        "catalog_id": catalog["catalog_id"], "name": "overdue", "complexity": "hard",
+        "deadline": (cutoff - timedelta(days=1)).isoformat(),
+    }, headers=headers).json()
+
+    task_scheduler.sweep_overdue_tasks(db, cutoff)
+
+    db.expire_all()
+    assert db.get(models.Task, due_today["task_id"]) is not None
+    assert db.get(models.Task, overdue["task_id"]) is None
+    user = db.get(models.User, user_id)
+    assert user.lives == user.max_lives - task_scheduler.OVERDUE_DAMAGE["hard"]
+    # Граница дня - самый западный пояс: она не наступает раньше, чем по UTC
+    assert cutoff <= datetime.utcnow().date()
@@ -0,0 +1,90 @@
+from app import boss_damage, crud, models
+
+
+def _create_team(client, headers, name):
+    response = client.post("/api/teams", json={"name": name}, headers=headers)
+    assert response.status_code in (200, 201), response.text
+    return response.json()["team_id"]
+
+
+def test_removed_member_loses_access_despite_cached_snapshot(client, register, db):
+    owner_id, owner = register()
+    member_id, member = register()
+    team_id = _create_team(client, owner, "stale-cache")
+    assert client.post("/api/teams/join", json={"team_name": "stale-cache"}, headers=member).status_code == 200
+    # Снимок участника с командой попадает в кэш этого процесса
+    assert client.get(f"/api/teams/{team_id}/chat", headers=member).status_code == 200
+
+    # Исключение на другом воркере: БД изменилась, локальный кэш не сброшен
+    db.query(models.User).filter(models.User.user_id == member_id).update({"team_id": None})
+    db.commit()
+
+    assert client.get(f"/api/teams/{team_id}/chat", headers=member).status_code == 403
+    assert client.post(f"/api/teams/{team_id}/chat", json={"message": "hi"}, headers=member).status_code == 403
+    assert client.post(f"/api/teams/{team_id}/attack-boss", headers=member).status_code == 403
+    assert client.post(f"/api/teams/{team_id}/leave", headers=member).status_code == 400
+    assert client.get("/api/teams/my-team", headers=member).status_code == 404
+
+
+
+def _team_stats(db, team_id):
+    db.expire_all()
+    team = db.get(models.Team, team_id)
+    return team.members_count, team.level_sum
+
+
+def test_team_counters_follow_membership(client, register, db):
+    owner_id, owner = register()
+    member_id, member = register()
+    first_id = _create_team(client, owner, "counters-1")
+    assert client.post("/api/teams/join", json={"team_name": "counters-1"}, headers=member).status_code == 200
+    assert _team_stats(db, first_id) == (2, 2)
+
+    # Смена команды через профиль не проходит мимо счетчиков
+    response = client.put("/api/users/me", json={"team_id": None, "level": 5}, headers=member)
+    assert response.status_code == 400
+    assert _team_stats(db, first_id) == (2, 2)
+
+    # Владелец не может создать вторую команду и выйти из первой в обход leave_team
+    assert client.post("/api/teams", json={"name": "counters-2"}, headers=owner).status_code == 400
+    assert _team_stats(db, first_id) == (2, 2)
+
+    assert client.put("/api/users/me", json={"level": 4}, headers=member).status_code == 200
+    assert _team_stats(db, first_id) == (2, 5)
+
+
+def test_member_with_stale_snapshot_cannot_create_team(client, register, db):
+    owner_id, owner = register()
+    member_id, member = register()
+    team_id = _create_team(client, owner, "stale-create")
+    # Снимок участника без команды попадает в кэш этого процесса
+    assert client.get("/api/teams/my-team", headers=member).status_code == 404
+
+    # Вступление на другом воркере
+    db.query(models.User).filter(models.User.user_id == member_id).update({"team_id": team_id})
+    db.commit()
+
+    assert client.post("/api/teams", json={"name": "stale-create-2"}, headers=member).status_code == 400
+    assert client.post("/api/teams/join", json={"team_name": "stale-create"}, headers=member).status_code == 400
+    db.expire_all()
+    assert db.get(models.User, member_id).team_id == team_id
+
+
+
+def test_failed_killing_blow_keeps_damage(client, register, db, monkeypatch):
+    owner_id, owner = register()
+    member_id, member = register()
+    team_id = _create_team(client, owner, "boss-flush")
+    assert client.post("/api/teams/join", json={"team_name": "boss-flush"}, headers=member).status_code == 200
+    db.query(models.User).filter(models.User.user_id == owner_id).update({"attack": 10 ** 6})
+    db.commit()
+
+    def database_down(*args):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(crud, "apply_boss_damage", database_down)
+    response = client.post(f"/api/teams/{team_id}/attack-boss", headers=owner)
+    assert response.status_code == 200, response.text
+    assert response.json()["boss_defeated"] is False
+    # Добивающий удар не потерян: он остался в накопителе до следующей записи
+    assert sum(boss_damage.accumulator.take(team_id).values()) == 10 ** 6
@@ -0,0 +1,39 @@
+def test_patch_me_sets_lives(client, register):
+    user_id, headers = register()
+
+    response = client.patch("/api/users/me", json=client.get("/api/users/me", headers=headers).json() | {"lives": 6}, headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json()["lives"] == 6
+    assert client.get("/api/users/me", headers=headers).json()["lives"] == 6
+
+
+def test_patch_me_zero_lives_loses_level(client, register, db):
+    from app import models
+
+    user_id, headers = register()
+    db.query(models.User).filter(models.User.user_id == user_id).update({"level": 3, "points": 50})
+    db.commit()
+
+    response = client.patch("/api/users/me", json=client.get("/api/users/me", headers=headers).json() | {"lives": 0}, headers=headers)
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["lives"] == body["max_lives"]
+    assert body["level"] == 2
+    assert body["points"] == 0
+
+
+def test_me_is_read_from_database_not_cached_snapshot(client, register, db):
+    from app import models
+
+    user_id, headers = register()
+    assert client.get("/api/users/me", headers=headers).status_code == 200
+
+    # Изменение на другом воркере: БД обновлена, локальный снимок не сброшен
+    db.query(models.User).filter(models.User.user_id == user_id).update({"lives": 4, "attack": 7})
+    db.commit()
+
+    body = client.get("/api/users/me", headers=headers).json()
+    assert body["lives"] == 4
+    assert body["attack"] == 7
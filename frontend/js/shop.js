@@ -435,11 +435,16 @@ async function buyItem(itemId) {
       return;
     }
     
+    // Один ключ на покупку: повторная отправка не спишет золото дважды
+    const idempotencyKey = window.crypto && crypto.randomUUID
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
     const response = await fetch(`${window.API_BASE_URL}/items/buy`, {
       method: 'POST',
       headers: {
         'Authorization': `Bearer ${token}`,
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        'Idempotency-Key': idempotencyKey
       },
       body: JSON.stringify({
         item_id: itemId
@@ -450,13 +455,20 @@ async function buyItem(itemId) {
       throw new Error('Failed to buy item');
     }
     
-    // Обновляем золото пользователя
-    userGold -= item.price;
+    const result = await response.json();
+    
+    // Обновляем золото пользователя (баланс возвращает сервер)
+    userGold = result.user_gold;
     const goldElement = document.getElementById('user-gold');
     if (goldElement) {
       goldElement.textContent = userGold;
     }
     
+    if (!result.success) {
+      alert(result.message);
+      return;
+    }
+    
     alert(`Вы успешно приобрели ${item.name}!`);
     
     // Снимаем выделение с предмета
@@ -11,8 +11,6 @@ let tasks = [];
 let catalogs = [];
 let currentEditingTaskId = null;
 let currentCatalogId = null;
-// Хранилище для отслеживания задач, за которые уже был нанесен урон
-let damagedTaskIds = new Set();
 
 
 // Fetch user's catalogs from API
@@ -24,13 +22,15 @@ async function fetchCatalogs() {
       return;
     }
 
-    const response = await fetch(`${window.API_BASE_URL}/catalogs/`, {
+    const response = await fetch(`${window.API_BASE_URL}/catalogs/tree`, {
       headers: { "Authorization": `Bearer ${token}` }
     });
 
     if (response.ok) {
       const data = await response.json();
+      // Дерево уже содержит задачи каталогов - отдельный запрос за ними не нужен
       catalogs = data;
+      tasks = data.flatMap(catalog => catalog.tasks);
       renderCatalogs();
     } else {
       console.error("Failed to fetch catalogs:", response.status);
@@ -71,145 +71,6 @@ async function createDefaultCatalog() {
   }
 }
 
-// Fetch tasks for a specific catalog
-async function fetchCatalogTasks(catalogId) {
-  try {
-    const token = localStorage.getItem("access_token");
-    if (!token) return;
-
-    const response = await fetch(`${window.API_BASE_URL}/catalogs/${catalogId}/tasks`, {
-      headers: { "Authorization": `Bearer ${token}` }
-    });
-
-    if (response.ok) {
-      const catalogTasks = await response.json();
-      // Merge with existing tasks, replacing any with same ID
-      tasks = tasks.filter(t => t.catalog_id !== catalogId);
-      tasks = [...tasks, ...catalogTasks];
-      renderTasks();
-      // Проверяем просроченные выполненные задачи после загрузки всех задач
-      checkOverdueCompletedTasks();
-
-    }
-  } catch (error) {
-    console.error(`Error fetching tasks for catalog ${catalogId}:`, error);
-  }
-}
-
-// Fetch all tasks for all catalogs
-async function fetchAllTasks() {
-  tasks = [];
-  for (const catalog of catalogs) {
-    await fetchCatalogTasks(catalog.catalog_id);
-  }
-}
-
-// Функция для проверки просроченных выполненных задач и нанесения урона
-async function checkOverdueCompletedTasks() {
-  const today = new Date();
-  today.setHours(0, 0, 0, 0);
-  
-  // Собираем просроченные выполненные задачи
-  const overdueTasks = tasks.filter(task => {
-    // Проверяем, что задача выполнена
-    if (task.completed !== 'false') return false;
-    
-    // Проверяем, что у задачи есть дедлайн
-    if (!task.deadline) return false;
-    
-    // Проверяем, что дедлайн прошел
-    const deadlineDate = new Date(task.deadline);
-    deadlineDate.setHours(0, 0, 0, 0);
-    
-    // Проверяем, что за эту задачу еще не был нанесен урон
-    return deadlineDate < today && !damagedTaskIds.has(task.task_id);
-  });
-  
-  // Если есть просроченные выполненные задачи, наносим урон
-  if (overdueTasks.length > 0) {
-    for (const task of overdueTasks) {
-      await applyDamageForTask(task);
-    }
-    
-    // Обновляем список задач после нанесения урона и удаления
-    renderTasks();
-  }
-}
-
-// Функция для нанесения урона за задачу и её удаления
-async function applyDamageForTask(task) {
-  try {
-    const token = localStorage.getItem("access_token");
-    if (!token) return;
-    
-    // Определяем урон в зависимости от сложности задачи
-    let damage = 4; // По умолчанию для 'normal'
-    if (task.complexity === 'easy') {
-      damage = 3;
-    } else if (task.complexity === 'hard') {
-      damage = 5;
-    }
-    
-    // Сначала получаем текущее количество жизней пользователя
-    const userResponse = await fetch(`${window.API_BASE_URL}/users/me`, {
-      headers: {
-        "Authorization": `Bearer ${token}`
-      }
-    });
-    
-    if (!userResponse.ok) {
-      console.error(`Failed to get user info: ${userResponse.status}`);
-      return;
-    }
-    
-    const userData = await userResponse.json();
-    
-    // Проверяем, что у пользователя есть поле lives
-    if (userData.lives === undefined) {
-      console.error("User data doesn't contain lives field");
-      return;
-    }
-    
-    if (userData.class_id === 4) {
-      damage = damage - 1;
-    }
-
-    // Вычисляем новое значение жизней (целое число)
-    const currentLives = parseInt(userData.lives);
-    const newLives = Math.max(0, currentLives - damage); // Не даем уйти в отрицательные значения
-    
-    // Вызываем API для обновления жизней пользователя
-    const updateResponse = await fetch(`${window.API_BASE_URL}/users/me`, {
-      method: "PATCH",
-      headers: {
-        "Authorization": `Bearer ${token}`,
-        "Content-Type": "application/json"
-      },
-      body: JSON.stringify({
-        login: userData.login,
-        nickname: userData.nickname,
-        user_id: userData.user_id,
-        lives: newLives // Отправляем новое целочисленное значение
-      })
-    });
-    
-    if (updateResponse.ok) {
-      console.log(`Damage applied for task ${task.task_id}: ${damage} lives. Lives reduced from ${currentLives} to ${newLives}`);
-      
-      // Добавляем задачу в список тех, за которые уже нанесен урон
-      damagedTaskIds.add(task.task_id);
-      
-      // Удаляем задачу
-      await deleteTask(task.task_id);
-    } else {
-      console.error(`Failed to apply damage for task ${task.task_id}:`, updateResponse.status);
-    }
-  } catch (error) {
-    console.error(`Error applying damage for task ${task.task_id}:`, error);
-  }
-}
-
-
 // Render catalogs in the UI
 function renderCatalogs() {
   const container = document.getElementById('catalogs-container');
@@ -273,8 +134,8 @@ function renderCatalogs() {
     });
   });
   
-  // Fetch tasks for each catalog
-  fetchAllTasks();
+  // Задачи уже загружены вместе с каталогами - только перерисовываем их
+  renderTasks();
 }
 
 // Render tasks in the UI
@@ -649,38 +510,6 @@ function renderCalendarTasks(calendarTasks) {
   });
 }
 
-// Update task completion status
-async function updateTaskCompletion(taskId, completed) {
-  try {
-    const token = localStorage.getItem("access_token");
-    if (!token) return;
-
-    // In this implementation, we're not actually updating completion status
-    // as it's not part of the task schema. This would need to be implemented
-    // in a real application.
-    console.log(`Task ${taskId} completion status: ${completed}`);
-    if (completed) {
-      const task = tasks.find(t => t.task_id === taskId);
-      if (task && task.deadline) {
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-        const deadlineDate = new Date(task.deadline);
-        deadlineDate.setHours(0, 0, 0, 0);
-        
-        // Если дедлайн прошел и за эту задачу еще не был нанесен урон
-        if (deadlineDate < today && !damagedTaskIds.has(taskId)) {
-          await applyDamageForTask(task);
-          // Обновляем список задач после нанесения урона и удаления
-          tasks = tasks.filter(t => t.task_id !== taskId);
-          renderTasks();
-        }
-      }
-    }
-  } catch (error) {
-    console.error(`Error updating task ${taskId} completion:`, error);
-  }
-}
-
 // Open modal for new task
 function openNewTaskModal(catalogId) {
   currentEditingTaskId = null;
@@ -787,34 +616,16 @@ async function saveTask() {
           catalog_id: currentCatalogId,
           name: name,
           complexity: complexity,
-          deadline: deadline ? new Date(deadline).toISOString().split('T')[0] : null
+          deadline: deadline ? new Date(deadline).toISOString().split('T')[0] : null,
           // Поле experience_reward удалено, так как оно отсутствует в модели Task на бэкенде
+          // Дни повтора создаются сервером вместе с задачей
+          repeat_days: repeatDays
         })
       });
       
       if (response.ok) {
         const newTask = await response.json();
         tasks.push(newTask);
-        
-        // Add daily tasks if selected
-        if (repeatDays.length > 0) {
-          for (const day of repeatDays) {
-            await fetch(`${window.API_BASE_URL}/daily-tasks/`, {
-              method: "POST",
-              headers: {
-                "Authorization": `Bearer ${token}`,
-                "Content-Type": "application/json"
-              },
-              body: JSON.stringify({
-                task_id: newTask.task_id,
-                day_week: day
-              })
-            });
-          }
-          
-          // Refresh task to get daily_tasks
-          await fetchCatalogTasks(currentCatalogId);
-        }
       }
     }
     